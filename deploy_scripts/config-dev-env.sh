@@ -32,6 +32,24 @@ export db_subnet_3="[your-subnet-3]"
 # ----- API Stack ----- #
 export api_stage_name="dev"
 export log_level="DEBUG"  # debug/info/error
+export provisioned_concurrency="0"  # provisioned concurrency on the 'live' alias (0 disables it)
+export keep_warm_schedule="rate(5 minutes)"  # keeps Lambda containers and Aurora Serverless warm
+export keep_warm_state="DISABLED"  # ENABLED/DISABLED; ENABLED keeps Aurora Serverless from auto-pausing
+export hedged_reads="false"  # true: hedge slow GET reads with a duplicate Data API request
+export db_client_connect_timeout="2"  # rds-data client connect timeout (seconds)
+export db_client_read_timeout="50"  # rds-data client read timeout (seconds), above the 45 s Data API statement timeout
+export db_client_max_pool_connections="20"  # rds-data client connection pool size
+export db_client_retry_mode="standard"  # legacy/standard/adaptive
+export db_client_max_attempts="3"  # attempts per rds-data call, including the first one
+export circuit_breaker="true"  # fail fast (503) while the database is unavailable
+export tenant_rate_limit="0"  # POST tokens/second per aws_account (0 disables rate limiting)
+export tenant_burst="50"  # token bucket capacity per aws_account
+export tenant_rate_limit_store="aurora"  # aurora (shared by all Lambda containers) or memory (per container)
+export tenant_rate_limit_sync_secs="1"  # seconds between syncs of per container buckets with the aurora ones
+export package_version_summary="false"  # true: maintain package_version_summary for fast package version reports
+export change_feed_settle_secs=5  # GET /ec2 leaves out EC2s saved less than this many seconds ago
+export change_feed_max_packages=1000  # maximum package rows per GET /ec2 page
+export export_bucket_name=""  # S3 bucket for inventory exports (empty: export function not deployed)
 
 # ---------------------------------------------------------------
 
@@ -1,43 +1,229 @@
 import boto3
-import json
+import hashlib
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+table_ddl_script_files = ['table_ec2.txt', 'table_package.txt', 'table_ec2_package.txt', 'table_package_version_summary.txt', 'table_token_bucket.txt']
+
+# Scripts bringing tables created from an earlier version of their DDL script up to date, in order.
+# CREATE TABLE IF NOT EXISTS does not alter existing tables: a changed DDL script needs a migration.
+# Statements are separated by ';' at the end of a line. Each statement is recorded once it succeeds, so
+# a failed migration resumes from the statement that failed.
+table_migration_files = {
+    'ec2': ['migration_ec2_completion_date.txt'],
+    'ec2_package': ['migration_ec2_package_primary_key.txt'],
+    'token_bucket': ['migration_token_bucket_drop_admitted.txt']
+}
+
+# Stores a checksum of each DDL script applied so unchanged objects are skipped on re-runs
+schema_checksum_table_name = 'schema_checksum'
+
+# Number of independent tables created concurrently
+max_workers = int(os.getenv('schema_max_workers', '4'))
+
+# Aurora Serverless may take a while to resume from auto-pause
+max_attempts = int(os.getenv('schema_max_attempts', '10'))
+retry_base_delay_secs = float(os.getenv('schema_retry_base_delay_secs', '2'))
+retry_max_delay_secs = 30
+
+resume_error_codes = ['DatabaseResumingException', 'ServiceUnavailableError']
+resume_error_messages = ['Communications link failure', 'is resuming after being auto-paused']
+
+create_table_regex = re.compile(r'create\s+table\s+(?:if\s+not\s+exists\s+)?`?(\w+)`?', re.IGNORECASE)
+references_regex = re.compile(r'references\s+`?(\w+)`?', re.IGNORECASE)
 
 def get_cfn_output(key, outputs):
     result = [ v['OutputValue'] for v in outputs if v['OutputKey'] == key ]
     return result[0] if len(result) > 0 else ''
 
-# Retrieve required parameters from RDS stack exported output values
-rds_stack_name = os.getenv('rds_stack_name')
-cloudformation = boto3.resource('cloudformation')
-stack = cloudformation.Stack(rds_stack_name)
-database_name = get_cfn_output('DatabaseName', stack.outputs)
-db_cluster_arn = get_cfn_output('DatabaseClusterArn', stack.outputs)
-db_credentials_secrets_store_arn = get_cfn_output('DatabaseSecretArn', stack.outputs)
-print(f'Database info: [name={database_name}, cluster arn={db_cluster_arn}, secrets arn={db_credentials_secrets_store_arn}]')
-
-# Run DDL commands idempotently to create database and tables
-rds_client = boto3.client('rds-data')
-
-table_ddl_script_files = ['table_ec2.txt', 'table_package.txt', 'table_ec2_package.txt']
-
-def execute_statement(sql):
-    print(f'Running SQL statement: {sql}')
-    response = rds_client.execute_statement(
-        secretArn=db_credentials_secrets_store_arn,
-        database=database_name,
-        resourceArn=db_cluster_arn,
-        sql=sql
+def get_database_info():
+    # Explicit values (eg, a local Data API stand-in) take precedence over the RDS stack outputs
+    database_name = os.getenv('db_name')
+    db_cluster_arn = os.getenv('db_cluster_arn')
+    db_credentials_secrets_store_arn = os.getenv('db_credentials_secrets_store_arn')
+    if database_name and db_cluster_arn and db_credentials_secrets_store_arn:
+        return database_name, db_cluster_arn, db_credentials_secrets_store_arn
+    # Retrieve required parameters from RDS stack exported output values
+    rds_stack_name = os.getenv('rds_stack_name')
+    cloudformation = boto3.resource('cloudformation')
+    stack = cloudformation.Stack(rds_stack_name)
+    return (
+        get_cfn_output('DatabaseName', stack.outputs),
+        get_cfn_output('DatabaseClusterArn', stack.outputs),
+        get_cfn_output('DatabaseSecretArn', stack.outputs)
     )
-    return response
 
-execute_statement(f'create database if not exists {database_name}')
+def get_rdsdata_client():
+    # eg, http://127.0.0.1:8080 for a local Data API stand-in
+    endpoint_url = os.getenv('rds_data_endpoint_url')
+    return boto3.client('rds-data', endpoint_url=endpoint_url) if endpoint_url else boto3.client('rds-data')
+
+def is_resume_error(e):
+    response = getattr(e, 'response', None) or {}
+    error = response.get('Error', {})
+    if error.get('Code') in resume_error_codes:
+        return True
+    message = error.get('Message', str(e))
+    return any(resume_message in message for resume_message in resume_error_messages)
+
+def checksum(ddl):
+    normalized_ddl = ' '.join(ddl.split()).lower()
+    return hashlib.sha256(normalized_ddl.encode('utf-8')).hexdigest()
+
+def load_migrations(migration_files, ddl_scripts_dir='.'):
+    migrations = []
+    for migration_file in migration_files:
+        with open(os.path.join(ddl_scripts_dir, migration_file), 'r') as migration_script:
+            script = migration_script.read()
+        statements = [ statement.strip() for statement in re.split(r';\s*$', script, flags=re.MULTILINE) if statement.strip() ]
+        migrations.append({'name': f'migration/{migration_file}', 'statements': statements, 'checksum': checksum(script)})
+    return migrations
+
+def load_ddl_scripts(ddl_script_files, ddl_scripts_dir='.', migration_files=None):
+    # Returns {table name: {'ddl', 'checksum', 'depends_on', 'migrations'}} based on the FK references of each script
+    migration_files = table_migration_files if migration_files is None else migration_files
+    tables = dict()
+    for ddl_script_file in ddl_script_files:
+        with open(os.path.join(ddl_scripts_dir, ddl_script_file), 'r') as ddl_script:
+            ddl = ddl_script.read()
+        match = create_table_regex.search(ddl)
+        if match is None:
+            raise ValueError(f'No CREATE TABLE statement found in DDL file: {ddl_script_file}')
+        table_name = match.group(1)
+        depends_on = set(references_regex.findall(ddl)) - {table_name}
+        migrations = load_migrations(migration_files.get(table_name, []), ddl_scripts_dir)
+        tables[table_name] = {'ddl': ddl, 'checksum': checksum(ddl), 'depends_on': depends_on, 'migrations': migrations}
+    for table_name, table in tables.items():
+        unknown_tables = table['depends_on'] - tables.keys()
+        if unknown_tables:
+            raise ValueError(f'Table {table_name} references tables with no DDL script: {sorted(unknown_tables)}')
+    return tables
+
+class SchemaDeployer:
+
+    def __init__(self, rds_client, database_name, db_cluster_arn, db_credentials_secrets_store_arn):
+        self._rds_client = rds_client
+        self._database_name = database_name
+        self._db_cluster_arn = db_cluster_arn
+        self._db_credentials_secrets_store_arn = db_credentials_secrets_store_arn
+
+    def execute_statement(self, sql, sql_parameters=[], continue_after_timeout=False):
+        # DDL statements keep running when the call times out, rather than being rolled back halfway
+        print(f'Running SQL statement: {sql}')
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return self._rds_client.execute_statement(
+                    secretArn=self._db_credentials_secrets_store_arn,
+                    database=self._database_name,
+                    resourceArn=self._db_cluster_arn,
+                    sql=sql,
+                    parameters=sql_parameters,
+                    continueAfterTimeout=continue_after_timeout
+                )
+            except Exception as e:
+                if attempt == max_attempts or not is_resume_error(e):
+                    raise
+                delay = min(retry_max_delay_secs, retry_base_delay_secs * 2 ** (attempt - 1))
+                print(f'Database not available yet (attempt {attempt}/{max_attempts}), retrying in {delay:.1f}s: {e}')
+                time.sleep(delay)
+
+    def _find_checksums(self):
+        response = self.execute_statement(f'select object_name, checksum from {schema_checksum_table_name}')
+        return { record[0]['stringValue']: record[1]['stringValue'] for record in response['records'] }
+
+    def _save_checksum(self, object_name, object_checksum):
+        sql_parameters = [
+            {'name':'object_name', 'value':{'stringValue': object_name}},
+            {'name':'checksum', 'value':{'stringValue': object_checksum}},
+        ]
+        sql = f'insert into {schema_checksum_table_name} (object_name, checksum)' \
+            f' values (:object_name, :checksum)' \
+            f' on duplicate key update checksum=values(checksum), applied_at=current_timestamp'
+        self.execute_statement(sql, sql_parameters)
+
+    def _table_exists(self, table_name):
+        sql_parameters = [
+            {'name':'table_name', 'value':{'stringValue': table_name}}
+        ]
+        response = self.execute_statement('select count(*) from information_schema.tables'
+            ' where table_schema=database() and table_name=:table_name', sql_parameters)
+        return response['records'][0][0]['longValue'] > 0
+
+    def _create_table(self, table_name, table, applied_checksums):
+        applied_checksum = applied_checksums.get(table_name)
+        if applied_checksum == table['checksum']:
+            print(f'Skipping unchanged table: {table_name}')
+            return False
+        if not self._table_exists(table_name):
+            print(f'Creating table: {table_name}')
+            self.execute_statement(table['ddl'], continue_after_timeout=True)
+            # the current DDL script already includes what its migrations do
+            for migration in table['migrations']:
+                self._save_checksum(migration['name'], migration['checksum'])
+            self._save_checksum(table_name, table['checksum'])
+            return True
+        # created from an earlier version of the DDL script (or before checksums were stored)
+        pending_migrations = [ migration for migration in table['migrations'] if migration['name'] not in applied_checksums ]
+        if applied_checksum is not None and len(pending_migrations) == 0:
+            raise ValueError(f'DDL for table {table_name} changed since it was applied, but it has no pending migration:'
+                f' add one to table_migration_files')
+        for migration in pending_migrations:
+            print(f'Migrating table {table_name}: {migration["name"]}')
+            # statements are not idempotent (eg, ADD COLUMN): skip those applied by an earlier, failed run
+            for i, statement in enumerate(migration['statements'], 1):
+                step_name = f'{migration["name"]}#{i}'
+                if step_name in applied_checksums:
+                    print(f'Skipping applied statement {i} of {migration["name"]}')
+                    continue
+                self.execute_statement(statement, continue_after_timeout=True)
+                self._save_checksum(step_name, checksum(statement))
+            self._save_checksum(migration['name'], migration['checksum'])
+        self._save_checksum(table_name, table['checksum'])
+        return True
+
+    def deploy(self, tables):
+        self.execute_statement(f'create database if not exists {self._database_name}')
+        self.execute_statement(f'create table if not exists {schema_checksum_table_name} ('
+            f' object_name VARCHAR(255) NOT NULL,'
+            f' checksum CHAR(64) NOT NULL,'
+            f' applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,'
+            f' PRIMARY KEY (object_name))')
+        applied_checksums = self._find_checksums()
+
+        # Create each table as soon as all the tables it references exist
+        pending = { table_name: set(table['depends_on']) for table_name, table in tables.items() }
+        created = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = dict()
+            while pending or running:
+                ready_tables = [ table_name for table_name, depends_on in pending.items() if not depends_on ]
+                for table_name in ready_tables:
+                    pending.pop(table_name)
+                    future = executor.submit(self._create_table, table_name, tables[table_name], applied_checksums)
+                    running[future] = table_name
+                if not running:
+                    raise ValueError(f'Circular FK references between tables: {sorted(pending.keys())}')
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    table_name = running.pop(future)
+                    # re-raises the DDL error; tables depending on it are never created
+                    if future.result():
+                        created.append(table_name)
+                    for depends_on in pending.values():
+                        depends_on.discard(table_name)
+        return created
 
-for table_ddl_script_file in table_ddl_script_files:
-    print(f"Creating table from DDL file: {table_ddl_script_file}")
-    with open(table_ddl_script_file, 'r') as ddl_script:
-        ddl_script_content=ddl_script.read()
-        execute_statement(ddl_script_content)
+if __name__ == '__main__':
+    database_name, db_cluster_arn, db_credentials_secrets_store_arn = get_database_info()
+    print(f'Database info: [name={database_name}, cluster arn={db_cluster_arn}, secrets arn={db_credentials_secrets_store_arn}]')
 
-response = execute_statement(f'show tables')
-print(response)
+    # Run DDL commands idempotently to create database and tables
+    tables = load_ddl_scripts(table_ddl_script_files, os.path.dirname(os.path.abspath(__file__)))
+    deployer = SchemaDeployer(get_rdsdata_client(), database_name, db_cluster_arn, db_credentials_secrets_store_arn)
+    created_tables = deployer.deploy(tables)
+    print(f'Tables created or updated: {created_tables}')
 
+    response = deployer.execute_statement(f'show tables')
+    print(response)
@@ -24,6 +24,24 @@ sam deploy \
         DatabaseStackName="${rds_stack_name}" \
         ApiStageName="${api_stage_name}" \
         LambdaLogLevel="${log_level}" \
+        ProvisionedConcurrency="${provisioned_concurrency}" \
+        KeepWarmSchedule="${keep_warm_schedule}" \
+        KeepWarmState="${keep_warm_state}" \
+        HedgedReads="${hedged_reads}" \
+        DbClientConnectTimeout="${db_client_connect_timeout}" \
+        DbClientReadTimeout="${db_client_read_timeout}" \
+        DbClientMaxPoolConnections="${db_client_max_pool_connections}" \
+        DbClientRetryMode="${db_client_retry_mode}" \
+        DbClientMaxAttempts="${db_client_max_attempts}" \
+        CircuitBreaker="${circuit_breaker}" \
+        TenantRateLimit="${tenant_rate_limit}" \
+        TenantBurst="${tenant_burst}" \
+        TenantRateLimitStore="${tenant_rate_limit_store}" \
+        TenantRateLimitSyncSecs="${tenant_rate_limit_sync_secs}" \
+        PackageVersionSummary="${package_version_summary}" \
+        ChangeFeedSettleSecs="${change_feed_settle_secs}" \
+        ChangeFeedMaxPackages="${change_feed_max_packages}" \
+        ExportBucketName="${export_bucket_name}" \
     --capabilities \
         CAPABILITY_IAM
 
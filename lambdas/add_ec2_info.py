@@ -17,7 +17,10 @@
 
 import os
 from helper.dal import *
+from helper.circuitbreaker import circuit_breaker_from_env
+from helper.admission import AdmissionController, AuroraTokenBucketStore, InMemoryTokenBucketStore
 from helper.lambdautils import *
+from helper.payload import Ec2Payload
 from helper.logger import get_logger
 
 logger = get_logger(__name__)
@@ -26,9 +29,29 @@ database_name = os.getenv('DB_NAME')
 db_cluster_arn = os.getenv('DB_CLUSTER_ARN')
 db_credentials_secrets_store_arn = os.getenv('DB_CRED_SECRETS_STORE_ARN')
 
-dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn)
+dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn, circuit_breaker=circuit_breaker_from_env())
+
+# Per aws_account admission control (0 disables it): requests cost 1 token plus
+# TENANT_PACKAGE_COST per package, refilled at TENANT_RATE_LIMIT tokens per second.
+# Buckets are per container, synced every TENANT_RATE_LIMIT_SYNC_SECS with buckets shared by all
+# containers in Aurora (TENANT_RATE_LIMIT_STORE=aurora), or only per container (memory), which
+# lets an account get a fresh burst from each new container
+tenant_rate_limit = float(os.getenv('TENANT_RATE_LIMIT', '0'))
+tenant_burst = float(os.getenv('TENANT_BURST', '50'))
+tenant_package_cost = float(os.getenv('TENANT_PACKAGE_COST', '0.01'))
+tenant_rate_limit_store = os.getenv('TENANT_RATE_LIMIT_STORE', 'aurora')
+tenant_rate_limit_sync_secs = float(os.getenv('TENANT_RATE_LIMIT_SYNC_SECS', '1'))
+token_bucket_stores = {
+    'aurora': lambda: AuroraTokenBucketStore(dal, tenant_rate_limit_sync_secs),
+    'memory': lambda: InMemoryTokenBucketStore()
+}
+if tenant_rate_limit_store not in token_bucket_stores:
+    raise ValueError(f'Invalid TENANT_RATE_LIMIT_STORE: {tenant_rate_limit_store} (valid values: {list(token_bucket_stores)})')
+admission_controller = AdmissionController(token_bucket_stores[tenant_rate_limit_store](), tenant_rate_limit, tenant_burst, tenant_package_cost) \
+    if tenant_rate_limit > 0 else None
 
 ec2_valid_fields = ['aws_account', 'aws_region', 'packages']
+ec2_mandatory_fields = ['aws_account', 'aws_region']
 
 #-----------------------------------------------------------------------------------------------
 # Input Validation
@@ -44,24 +67,42 @@ def validate_ec2_input_parameters(input_fields):
     for field in input_fields:
         if field not in ec2_valid_fields:
             raise ValueError(f'Invalid EC2 input parameter: {field}')
+    for field in ec2_mandatory_fields:
+        if field not in input_fields:
+            raise ValueError(f'Invalid input - missing EC2 mandatory attribute: {field}')
 
 def validate_input(event):
+    # packages are validated here but only decoded again, a chunk at a time, while being saved
     aws_instance_id = validate_ec2_path_parameters(event)
     if key_missing_or_empty_value(event, 'body'):
         raise ValueError('Invalid input - body must contain EC2 mandatory attributes')
-    input_fields = json.loads(event['body'])
-    validate_ec2_input_parameters(input_fields.keys())
-    return aws_instance_id, input_fields
+    payload = Ec2Payload(event['body'])
+    validate_ec2_input_parameters(payload.field_names)
+    return aws_instance_id, payload
 
 #-----------------------------------------------------------------------------------------------
 # Lambda Entrypoint
 #-----------------------------------------------------------------------------------------------
 def handler(event, context):
     try:
-        logger.info(f'Event received: {event}')
-        aws_instance_id, input_fields = validate_input(event)
+        if is_warmup_event(event):
+            return warm_up(dal)
+        logger.info(f'Event received: {loggable_event(event)}')
+        aws_instance_id, payload = validate_input(event)
+        if admission_controller is not None:
+            admission_controller.admit(str(payload.fields['aws_account']), payload.num_packages)
+        input_fields = dict(payload.fields, packages=payload.iter_packages())
         dal.save_ec2(aws_instance_id, input_fields)
-        output = {'new_record': input_fields}
+        # a summary rather than the input, which can be several MB
+        output = {
+            'new_record': {
+                'aws_instance_id': aws_instance_id,
+                'aws_region': payload.fields['aws_region'],
+                'aws_account': payload.fields['aws_account'],
+                'num_packages': payload.num_packages,
+                'packages_sha256': payload.packages_sha256
+            }
+        }
         logger.debug(f'Output: {output}')
         return success(output)
     except Exception as e:
@@ -0,0 +1,62 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Bulk loads historical inventory files (NDJSON or CSV, optionally gzipped) into the database.
+#
+# Usage (from the project's root directory):
+#   export DB_NAME=... DB_CLUSTER_ARN=... DB_CRED_SECRETS_STORE_ARN=...
+#   python lambdas/bulk_load.py inventory.ndjson.gz --batch-size 1000 --max-workers 8
+
+import argparse
+import os
+from helper.dal import DataAccessLayer
+from helper.loader import BulkLoader, Checkpoint
+from helper.logger import get_logger
+
+logger = get_logger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load EC2 inventory files into the database')
+    parser.add_argument('file', nargs='?', help='NDJSON (one EC2 per line) or CSV (one EC2-package relation per row) file, optionally gzipped')
+    parser.add_argument('--database-name', default=os.getenv('DB_NAME'))
+    parser.add_argument('--db-cluster-arn', default=os.getenv('DB_CLUSTER_ARN'))
+    parser.add_argument('--db-credentials-secrets-store-arn', default=os.getenv('DB_CRED_SECRETS_STORE_ARN'))
+    parser.add_argument('--batch-size', type=int, default=1000, help='parameter sets per batch_execute_statement call')
+    parser.add_argument('--max-workers', type=int, default=4, help='concurrent batch_execute_statement calls')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='batches buffered or running at any time')
+    parser.add_argument('--checkpoint-file', help='defaults to <file>.checkpoint')
+    parser.add_argument('--progress-interval-secs', type=float, default=10)
+    parser.add_argument('--rebuild-summary', action='store_true', help='recompute package_version_summary once loaded (bulk loads bypass it)')
+    args = parser.parse_args()
+
+    if not (args.database_name and args.db_cluster_arn and args.db_credentials_secrets_store_arn):
+        parser.error('database name, cluster ARN and secrets store ARN are required')
+    if not (args.file or args.rebuild_summary):
+        parser.error('an inventory file and/or --rebuild-summary is required')
+
+    dal = DataAccessLayer(args.database_name, args.db_cluster_arn, args.db_credentials_secrets_store_arn)
+    if args.file:
+        checkpoint = Checkpoint(args.checkpoint_file or f'{args.file}.checkpoint')
+        loader = BulkLoader(dal, args.batch_size, args.max_workers, args.max_in_flight, checkpoint, args.progress_interval_secs)
+        rows_written = loader.load(args.file)
+        logger.info(f'Bulk load completed: {rows_written}')
+    if args.rebuild_summary:
+        dal.rebuild_package_version_summary()
+        logger.info('Package version summary rebuilt')
+
+if __name__ == '__main__':
+    main()
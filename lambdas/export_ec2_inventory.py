@@ -0,0 +1,82 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import time
+from helper.dal import *
+from helper.export import *
+from helper.lambdautils import *
+from helper.logger import get_logger
+
+logger = get_logger(__name__)
+
+database_name = os.getenv('DB_NAME')
+db_cluster_arn = os.getenv('DB_CLUSTER_ARN')
+db_credentials_secrets_store_arn = os.getenv('DB_CRED_SECRETS_STORE_ARN')
+export_bucket_name = os.getenv('EXPORT_BUCKET_NAME')
+export_prefix = os.getenv('EXPORT_PREFIX', 'exports')
+export_max_workers = int(os.getenv('EXPORT_MAX_WORKERS', '4'))
+# stop starting new pages when less than this is left before the Lambda timeout
+export_deadline_margin_ms = int(os.getenv('EXPORT_DEADLINE_MARGIN_MS', '15000'))
+
+dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn)
+writer = S3ChunkWriter(export_bucket_name, export_prefix)
+
+max_page_size = 5000
+
+#-----------------------------------------------------------------------------------------------
+# Input Validation
+#-----------------------------------------------------------------------------------------------
+def validate_input(event):
+    export_format = event.get('format', 'ndjson')
+    if export_format not in export_formats:
+        raise ValueError(f'Invalid export format: {export_format}')
+    page_size = int(event.get('page_size', 1000))
+    if page_size < 1 or page_size > max_page_size:
+        raise ValueError(f'Invalid page_size: {page_size} (must be between 1 and {max_page_size})')
+    tables = event.get('tables', list(export_table_specs.keys()))
+    for table_name in tables:
+        if table_name not in export_table_specs:
+            raise ValueError(f'Invalid table: {table_name}')
+    export_id = event.get('export_id', time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()))
+    return export_id, export_format, page_size, tables
+
+#-----------------------------------------------------------------------------------------------
+# Lambda Entrypoint
+#-----------------------------------------------------------------------------------------------
+def handler(event, context):
+    # The returned state is a valid input event: invoke the function again with it (eg, from a
+    # Step Functions loop) until 'complete' is true to resume the partitions left unfinished
+    logger.info(f'Event received: {event}')
+    export_id, export_format, page_size, tables = validate_input(event)
+    partitions = event.get('partitions')
+    if partitions is None:
+        partitions = build_partitions(dal, tables, event.get('key_splits'), int(event.get('partitions_per_table', 1)))
+    deadline = time.monotonic() + (context.get_remaining_time_in_millis() - export_deadline_margin_ms) / 1000
+    exporter = InventoryExporter(dal, writer, export_format, page_size, export_max_workers)
+    exporter.run(export_id, partitions, deadline)
+    output = {
+        'export_id': export_id,
+        'format': export_format,
+        'page_size': page_size,
+        'tables': tables,
+        'location': f's3://{export_bucket_name}/{export_prefix}/{export_id}/',
+        'partitions': partitions,
+        'complete': all(partition['complete'] for partition in partitions)
+    }
+    logger.debug(f'Output: {output}')
+    return output
@@ -0,0 +1,101 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+from datetime import datetime
+from helper.dal import *
+from helper.circuitbreaker import circuit_breaker_from_env
+from helper.lambdautils import *
+from helper.logger import get_logger
+
+logger = get_logger(__name__)
+
+database_name = os.getenv('DB_NAME')
+db_cluster_arn = os.getenv('DB_CLUSTER_ARN')
+db_credentials_secrets_store_arn = os.getenv('DB_CRED_SECRETS_STORE_ARN')
+
+dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn, circuit_breaker=circuit_breaker_from_env())
+
+date_format = '%Y-%m-%d %H:%M:%S'
+default_since = '1970-01-01 00:00:00'
+default_limit = 50
+max_limit = 100
+
+#-----------------------------------------------------------------------------------------------
+# Input Validation
+#-----------------------------------------------------------------------------------------------
+def validate_date(value, name):
+    try:
+        datetime.strptime(value, date_format)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid {name}: {value} (expected format: YYYY-MM-DD HH:MM:SS, UTC)')
+    return value
+
+def validate_query_parameters(event):
+    # Returns (since, after_key, after_package, limit); a continuation token carries since, after_key
+    # and, when the last EC2 of the previous page has more packages, after_package
+    query_parameters = event.get('queryStringParameters') or dict()
+    try:
+        limit = int(query_parameters.get('limit', default_limit))
+    except ValueError:
+        raise ValueError(f'Invalid limit query parameter: {query_parameters["limit"]}')
+    if limit < 1 or limit > max_limit:
+        raise ValueError(f'Invalid limit query parameter: {limit} (valid range: 1-{max_limit})')
+    if not key_missing_or_empty_value(query_parameters, 'next_token'):
+        state = decode_continuation_token(query_parameters['next_token'])
+        since = validate_date(state.get('since'), 'continuation token')
+        after_key = state.get('after')
+        after_package = state.get('after_package')
+        for key in [after_key, after_package]:
+            if key is not None and (not isinstance(key, list) or len(key) != 2):
+                raise ValueError(f'Invalid continuation token: {query_parameters["next_token"]}')
+        if after_package is not None and after_key is None:
+            raise ValueError(f'Invalid continuation token: {query_parameters["next_token"]}')
+        return since, after_key, after_package, limit
+    since = validate_date(query_parameters.get('since', default_since), 'since query parameter')
+    return since, None, None, limit
+
+#-----------------------------------------------------------------------------------------------
+# Lambda Entrypoint
+#-----------------------------------------------------------------------------------------------
+def handler(event, context):
+    try:
+        if is_warmup_event(event):
+            return warm_up(dal)
+        logger.info(f'Event received: {event}')
+        since, after_key, after_package, limit = validate_query_parameters(event)
+        records, has_more = dal.find_ec2s_completed_since(since, after_key, limit, after_package)
+        if len(records) > 0:
+            last_record = records[-1]
+            after_key = [last_record['completion_date_utc'], last_record['aws_instance_id']]
+            after_package = None
+            if last_record['more_packages']:
+                last_package = last_record['packages'][-1]
+                after_package = [last_package['package_name'], last_package['package_version']]
+        # always returned: polling with it later picks up EC2s saved in the meantime
+        state = {'since': since, 'after': after_key}
+        if after_package is not None:
+            state['after_package'] = after_package
+        output = {
+            'records': records,
+            'has_more': has_more,
+            'next_token': encode_continuation_token(state)
+        }
+        logger.debug(f'Output: {output}')
+        return success(output)
+    except Exception as e:
+        return handle_error(e)
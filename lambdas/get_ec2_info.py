@@ -16,6 +16,8 @@
 """
 
 from helper.dal import *
+from helper.circuitbreaker import circuit_breaker_from_env
+from helper.hedging import HedgePolicy
 from helper.lambdautils import *
 from helper.logger import get_logger
 
@@ -25,7 +27,12 @@ database_name = os.getenv('DB_NAME')
 db_cluster_arn = os.getenv('DB_CLUSTER_ARN')
 db_credentials_secrets_store_arn = os.getenv('DB_CRED_SECRETS_STORE_ARN')
 
-dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn)
+# opt-in hedged reads to cut tail latency while Aurora Serverless scales
+hedged_reads = os.getenv('DB_HEDGED_READS', 'false').lower() == 'true'
+hedge_budget_ratio = float(os.getenv('DB_HEDGE_BUDGET_RATIO', '0.05'))
+hedge_policy = HedgePolicy(budget_ratio=hedge_budget_ratio) if hedged_reads else None
+
+dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn, hedge_policy, circuit_breaker_from_env())
 
 #-----------------------------------------------------------------------------------------------
 # Input Validation
@@ -42,6 +49,8 @@ def validate_path_parameters(event):
 #-----------------------------------------------------------------------------------------------
 def handler(event, context):
     try:
+        if is_warmup_event(event):
+            return warm_up(dal)
         logger.info(f'Event received: {event}')
         aws_instance_id = validate_path_parameters(event)
         results = dal.find_ec2(aws_instance_id)
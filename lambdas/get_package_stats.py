@@ -0,0 +1,88 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+from datetime import datetime
+from helper.dal import *
+from helper.circuitbreaker import circuit_breaker_from_env
+from helper.lambdautils import *
+from helper.logger import get_logger
+
+logger = get_logger(__name__)
+
+database_name = os.getenv('DB_NAME')
+db_cluster_arn = os.getenv('DB_CLUSTER_ARN')
+db_credentials_secrets_store_arn = os.getenv('DB_CRED_SECRETS_STORE_ARN')
+
+dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn, circuit_breaker=circuit_breaker_from_env())
+
+creation_date_format = '%Y-%m-%d %H:%M:%S'
+
+#-----------------------------------------------------------------------------------------------
+# Input Validation
+#-----------------------------------------------------------------------------------------------
+def validate_path_parameters(event):
+    if key_missing_or_empty_value(event, 'pathParameters'):
+        raise ValueError('Invalid input - missing package_name as part of path parameters')
+    if key_missing_or_empty_value(event['pathParameters'], 'package_name'):
+        raise ValueError('Invalid input - missing package_name as part of path parameters')
+    return event['pathParameters']['package_name']
+
+def validate_creation_date(query_parameters, name):
+    value = query_parameters.get(name)
+    if value is None:
+        return None
+    try:
+        datetime.strptime(value, creation_date_format)
+    except ValueError:
+        raise ValueError(f'Invalid {name} query parameter: {value} (expected format: YYYY-MM-DD HH:MM:SS, UTC)')
+    return value
+
+def validate_query_parameters(event):
+    query_parameters = event.get('queryStringParameters') or dict()
+    group_by = [ column for column in query_parameters.get('group_by', '').split(',') if column ]
+    for column in group_by:
+        if column not in package_version_group_by_columns:
+            raise ValueError(f'Invalid group_by query parameter: {column} (valid values: {package_version_group_by_columns})')
+    return {
+        'group_by': group_by,
+        'aws_region': query_parameters.get('aws_region'),
+        'aws_account': query_parameters.get('aws_account'),
+        'created_after': validate_creation_date(query_parameters, 'created_after'),
+        'created_before': validate_creation_date(query_parameters, 'created_before')
+    }
+
+#-----------------------------------------------------------------------------------------------
+# Lambda Entrypoint
+#-----------------------------------------------------------------------------------------------
+def handler(event, context):
+    try:
+        if is_warmup_event(event):
+            return warm_up(dal)
+        logger.info(f'Event received: {event}')
+        package_name = validate_path_parameters(event)
+        filters = validate_query_parameters(event)
+        results = dal.count_hosts_by_package_version(package_name, **filters)
+        output = {
+            'package_name': package_name,
+            'group_by': filters['group_by'],
+            'versions': results
+        }
+        logger.debug(f'Output: {output}')
+        return success(output)
+    except Exception as e:
+        return handle_error(e)
@@ -0,0 +1,136 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from .dal import DataAccessLayerException
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+class TooManyRequestsException(Exception):
+
+    def __init__(self, key, retry_after_secs):
+        super().__init__(f'Rate limit exceeded for {key}, retry after {retry_after_secs:.1f}s')
+        self.key = key
+        self.retry_after_secs = retry_after_secs
+
+#-----------------------------------------------------------------------------------------------
+# Token Bucket Stores
+#-----------------------------------------------------------------------------------------------
+class TokenBucketStore:
+    # Pluggable token bucket state, eg, in memory (per container) or in a shared store
+
+    def take(self, key, cost, rate_per_sec, capacity, now):
+        # Returns 0 if cost tokens were taken from the bucket, else the seconds until they will be available
+        raise NotImplementedError()
+
+class InMemoryTokenBucketStore(TokenBucketStore):
+    # Per container state, bounded to the max_keys most recently used keys
+
+    def __init__(self, max_keys=10000):
+        self._buckets = OrderedDict()
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate_per_sec, capacity, now):
+        with self._lock:
+            tokens, last_refill = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last_refill) * rate_per_sec)
+            retry_after_secs = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                retry_after_secs = (cost - tokens) / rate_per_sec
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after_secs
+
+class AuroraTokenBucketStore(TokenBucketStore):
+    # Two tiers, so a flooding key cannot get a fresh burst from every container Lambda scales out for
+    # it, and admission adds no database call to most requests: requests are admitted from a per
+    # container bucket, synced with the bucket shared by all containers (token_bucket table) at most
+    # every sync_interval_secs per key. A sync debits the cost admitted locally since the previous one
+    # and takes the shared level. Containers can over-admit a key between syncs; that is debited from
+    # the shared bucket, so the long run rate holds. If a sync fails (eg, the database is saturated or
+    # the circuit breaker is open), admission carries on from the local bucket rather than failing
+
+    def __init__(self, dal, sync_interval_secs=1.0, max_keys=10000):
+        self._dal = dal
+        self._sync_interval_secs = sync_interval_secs
+        # key -> [tokens, last_refill, last_sync, cost admitted since last sync]
+        self._buckets = OrderedDict()
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def _sync(self, key, bucket, rate_per_sec, capacity, now):
+        try:
+            bucket[0] = self._dal.sync_tokens(key, bucket[3], rate_per_sec, capacity)
+            bucket[1] = now
+            bucket[3] = 0
+        except DataAccessLayerException as de:
+            logger.warning(f'Token bucket sync failed for {key}, admitting from the local bucket: {de.original_exception}')
+        # failed syncs are retried at the next interval, not on every request
+        bucket[2] = now
+
+    def take(self, key, cost, rate_per_sec, capacity, now):
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = [capacity, now, None, 0]
+            if bucket[2] is None or now - bucket[2] >= self._sync_interval_secs:
+                self._sync(key, bucket, rate_per_sec, capacity, now)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate_per_sec)
+            bucket[1] = now
+            retry_after_secs = 0
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                bucket[3] += cost
+            else:
+                retry_after_secs = (cost - bucket[0]) / rate_per_sec
+            self._buckets[key] = bucket
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after_secs
+
+#-----------------------------------------------------------------------------------------------
+# Admission Control
+#-----------------------------------------------------------------------------------------------
+class AdmissionController:
+    # Cost-weighted token buckets per key (eg, aws_account): a request costs 1 token plus
+    # package_cost per package, capped to the bucket capacity so any request can eventually pass
+
+    def __init__(self, store, rate_per_sec, capacity, package_cost=0.01, clock=time.monotonic):
+        self._store = store
+        self._rate_per_sec = rate_per_sec
+        self._capacity = capacity
+        self._package_cost = package_cost
+        self._clock = clock
+
+    def cost(self, num_packages):
+        return min(self._capacity, 1 + num_packages * self._package_cost)
+
+    def admit(self, key, num_packages=0):
+        retry_after_secs = self._store.take(key, self.cost(num_packages), self._rate_per_sec, self._capacity, self._clock())
+        if retry_after_secs > 0:
+            raise TooManyRequestsException(key, retry_after_secs)
+
+def retry_after_header(retry_after_secs):
+    return str(max(1, math.ceil(retry_after_secs)))
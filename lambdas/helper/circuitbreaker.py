@@ -0,0 +1,189 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+from .logger import get_logger
+from .metrics import put_metric
+
+logger = get_logger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Data API errors meaning the database is unavailable or overloaded (as opposed to, eg, a duplicate key)
+unavailable_error_codes = ['ServiceUnavailableError', 'InternalServerErrorException', 'ThrottlingException',
+    'StatementTimeoutException', 'DatabaseResumingException', 'DatabaseUnavailableException']
+unavailable_error_messages = ['Communications link failure', 'is resuming after being auto-paused']
+
+class CircuitOpenException(Exception):
+
+    def __init__(self, name, retry_after_secs):
+        super().__init__(f'Circuit breaker {name} is open, retry after {retry_after_secs:.1f}s')
+        self.name = name
+        self.retry_after_secs = retry_after_secs
+
+def is_unavailable_error(e):
+    if isinstance(e, (ConnectionError, ReadTimeoutError)):
+        return True
+    if isinstance(e, ClientError):
+        error = e.response.get('Error', {})
+        return error.get('Code') in unavailable_error_codes \
+            or any(message in error.get('Message', '') for message in unavailable_error_messages)
+    return False
+
+#-----------------------------------------------------------------------------------------------
+# State Stores
+#-----------------------------------------------------------------------------------------------
+class CircuitBreakerStateStore:
+    # Pluggable breaker state (state, time it was opened). Only the in-memory, per-container store
+    # ships: the stack's one shared store is the database the breaker protects. The call window and
+    # counters stay on the CircuitBreaker instance, and opened_at comes from its (monotonic) clock,
+    # so a store shared across containers would also need a wall clock
+
+    def get_state(self, name):
+        raise NotImplementedError()
+
+    def set_state(self, name, state, opened_at):
+        raise NotImplementedError()
+
+class InMemoryCircuitBreakerStateStore(CircuitBreakerStateStore):
+
+    def __init__(self):
+        self._states = dict()
+
+    def get_state(self, name):
+        return self._states.get(name, (CLOSED, None))
+
+    def set_state(self, name, state, opened_at):
+        self._states[name] = (state, opened_at)
+
+#-----------------------------------------------------------------------------------------------
+# Circuit Breaker
+#-----------------------------------------------------------------------------------------------
+class CircuitBreaker:
+    # Closed: calls go through; opens when, over the last window_secs (and at least min_calls calls),
+    # the failure rate or the slow call rate reaches its threshold, or after consecutive_failures
+    # failed calls in a row. The latter is what trips a container serving one request at a time: with
+    # calls timing out after the client read timeout (and its retries) the window never holds min_calls.
+    # Open: calls fail fast with CircuitOpenException for open_secs.
+    # Half open: up to half_open_max_calls trial calls; one failure re-opens, all succeeding closes.
+
+    def __init__(self, name='rds-data', state_store=None, window_secs=30, min_calls=10, failure_rate_threshold=0.5,
+                 slow_call_ms=5000, slow_call_rate_threshold=0.8, consecutive_failures=3, open_secs=30,
+                 half_open_max_calls=1, is_failure=is_unavailable_error, clock=time.monotonic):
+        self._name = name
+        self._state_store = state_store if state_store is not None else InMemoryCircuitBreakerStateStore()
+        self._window_secs = window_secs
+        self._min_calls = min_calls
+        self._failure_rate_threshold = failure_rate_threshold
+        self._slow_call_ms = slow_call_ms
+        self._slow_call_rate_threshold = slow_call_rate_threshold
+        self._consecutive_failures = consecutive_failures
+        self._open_secs = open_secs
+        self._half_open_max_calls = half_open_max_calls
+        self._is_failure = is_failure
+        self._clock = clock
+        self._calls = deque()
+        self._num_consecutive_failures = 0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(self._clock())[0]
+
+    def _current_state(self, now):
+        state, opened_at = self._state_store.get_state(self._name)
+        if state == OPEN and now - opened_at >= self._open_secs:
+            self._transition(HALF_OPEN, opened_at)
+            state = HALF_OPEN
+        return state, opened_at
+
+    def _transition(self, state, opened_at):
+        previous_state = self._state_store.get_state(self._name)[0]
+        self._state_store.set_state(self._name, state, opened_at)
+        self._calls.clear()
+        self._num_consecutive_failures = 0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        logger.warning(f'Circuit breaker {self._name}: {previous_state} -> {state}')
+        put_metric('CircuitBreakerStateChange', 1, dimensions={'CircuitBreaker': self._name, 'State': state})
+        put_metric('CircuitBreakerOpen', 0 if state == CLOSED else 1, unit='None', dimensions={'CircuitBreaker': self._name})
+
+    def before_call(self):
+        with self._lock:
+            now = self._clock()
+            state, opened_at = self._current_state(now)
+            if state == OPEN:
+                raise CircuitOpenException(self._name, self._open_secs - (now - opened_at))
+            if state == HALF_OPEN:
+                if self._half_open_calls >= self._half_open_max_calls:
+                    raise CircuitOpenException(self._name, 1)
+                self._half_open_calls += 1
+
+    def record_call(self, latency_ms, exception=None):
+        failed = exception is not None and self._is_failure(exception)
+        slow = latency_ms >= self._slow_call_ms
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)[0]
+            if state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN, now)
+                else:
+                    self._half_open_successes += 1
+                    if self._half_open_successes >= self._half_open_max_calls:
+                        self._transition(CLOSED, None)
+                return
+            if state == OPEN:
+                return
+            self._num_consecutive_failures = self._num_consecutive_failures + 1 if failed else 0
+            if self._consecutive_failures > 0 and self._num_consecutive_failures >= self._consecutive_failures:
+                self._transition(OPEN, now)
+                return
+            self._calls.append((now, failed, slow))
+            while self._calls and now - self._calls[0][0] > self._window_secs:
+                self._calls.popleft()
+            num_calls = len(self._calls)
+            if num_calls < self._min_calls:
+                return
+            failure_rate = sum(1 for call in self._calls if call[1]) / num_calls
+            slow_call_rate = sum(1 for call in self._calls if call[2]) / num_calls
+            if failure_rate >= self._failure_rate_threshold or slow_call_rate >= self._slow_call_rate_threshold:
+                self._transition(OPEN, now)
+
+def circuit_breaker_from_env(name='rds-data', state_store=None):
+    # DB_CIRCUIT_BREAKER=false disables it; thresholds can be tuned through DB_CIRCUIT_BREAKER_* variables
+    if os.getenv('DB_CIRCUIT_BREAKER', 'true').lower() != 'true':
+        return None
+    return CircuitBreaker(
+        name,
+        state_store,
+        window_secs=float(os.getenv('DB_CIRCUIT_BREAKER_WINDOW_SECS', '30')),
+        min_calls=int(os.getenv('DB_CIRCUIT_BREAKER_MIN_CALLS', '10')),
+        failure_rate_threshold=float(os.getenv('DB_CIRCUIT_BREAKER_FAILURE_RATE', '0.5')),
+        slow_call_ms=float(os.getenv('DB_CIRCUIT_BREAKER_SLOW_CALL_MS', '5000')),
+        consecutive_failures=int(os.getenv('DB_CIRCUIT_BREAKER_CONSECUTIVE_FAILURES', '3')),
+        open_secs=float(os.getenv('DB_CIRCUIT_BREAKER_OPEN_SECS', '30'))
+    )
@@ -15,9 +15,17 @@
   SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import hashlib
 import json
+import logging
 import os
+import threading
+import time
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 from .logger import get_logger
 
 logger = get_logger(__name__)
@@ -32,19 +40,91 @@ if is_lambda_environment:
 ec2_table_name = os.getenv('EC2_TABLE_NAME', 'ec2')
 package_table_name = os.getenv('PACKAGE_TABLE_NAME', 'package')
 ec2_package_table_name = os.getenv('EC2_PACKAGE_TABLE_NAME', 'ec2_package')
+package_version_summary_table_name = os.getenv('PACKAGE_VERSION_SUMMARY_TABLE_NAME', 'package_version_summary')
+token_bucket_table_name = os.getenv('TOKEN_BUCKET_TABLE_NAME', 'token_bucket')
+# host counts per package version, region and account maintained incrementally on save_ec2
+package_version_summary_enabled = os.getenv('PACKAGE_VERSION_SUMMARY', 'false').lower() == 'true'
+
+# dimensions package version histograms can be broken down by
+package_version_group_by_columns = ['aws_region', 'aws_account']
+
+# EC2s completed less than this long ago are left out of the change feed: concurrent saves may
+# commit out of completion_date_utc order
+change_feed_settle_secs = int(os.getenv('CHANGE_FEED_SETTLE_SECS', '5'))
+# package rows per change feed page: keeps the packages query under the 1 MB Data API result limit
+# and the page under the 6 MB Lambda response limit (a package row is at most ~500 bytes)
+change_feed_max_packages = int(os.getenv('CHANGE_FEED_MAX_PACKAGES', '1000'))
+# sampled keys per export partition split points are taken from: enough for ranges of similar row
+# counts while keeping the sample far below the 1 MB Data API result limit
+key_split_samples_per_partition = 100
+
+# rds-data client settings (see the DB_CLIENT_* variables in api_cfn_template.yaml). The read timeout
+# stays above the Data API's 45 second statement timeout: a client-side timeout would make botocore
+# retry statements, writes included, that are still running on the server
+rdsdata_endpoint_url = os.getenv('RDS_DATA_ENDPOINT_URL')
+rdsdata_connect_timeout = float(os.getenv('DB_CLIENT_CONNECT_TIMEOUT', '2'))
+rdsdata_read_timeout = float(os.getenv('DB_CLIENT_READ_TIMEOUT', '50'))
+rdsdata_max_pool_connections = int(os.getenv('DB_CLIENT_MAX_POOL_CONNECTIONS', '20'))
+rdsdata_retry_mode = os.getenv('DB_CLIENT_RETRY_MODE', 'standard')
+rdsdata_max_attempts = int(os.getenv('DB_CLIENT_MAX_ATTEMPTS', '3'))
+
+rdsdata_clients = dict()
+rdsdata_clients_lock = threading.Lock()
+
+def rdsdata_client_config():
+    return Config(
+        connect_timeout=rdsdata_connect_timeout,
+        read_timeout=rdsdata_read_timeout,
+        max_pool_connections=rdsdata_max_pool_connections,
+        retries={'mode': rdsdata_retry_mode, 'max_attempts': rdsdata_max_attempts}
+    )
+
+def get_rdsdata_client(endpoint_url=None):
+    # One client, hence one connection pool, per container and endpoint: DataAccessLayer instances
+    # share it so connections (and their TLS sessions) are reused across instances and invocations
+    endpoint_url = endpoint_url if endpoint_url is not None else rdsdata_endpoint_url
+    with rdsdata_clients_lock:
+        if endpoint_url not in rdsdata_clients:
+            rdsdata_clients[endpoint_url] = boto3.client('rds-data', endpoint_url=endpoint_url, config=rdsdata_client_config())
+        return rdsdata_clients[endpoint_url]
+
+class PackageSet:
+    # Fixed-size 16-byte digests of (name, version) instead of the strings themselves, so tens of
+    # millions of relations referencing a few million distinct packages fit in memory
+    def __init__(self):
+        self._digests = set()
+
+    def add(self, package_name, package_version):
+        digest = hashlib.blake2b(f'{package_name}\0{package_version}'.encode('utf-8'), digest_size=16).digest()
+        if digest in self._digests:
+            return False
+        self._digests.add(digest)
+        return True
+
+    def __len__(self):
+        return len(self._digests)
 
 class DataAccessLayerException(Exception):
 
     def __init__(self, original_exception):
         self.original_exception = original_exception
 
+def is_duplicate_key_error(e):
+    return isinstance(e, ClientError) and 'Duplicate entry' in e.response.get('Error', {}).get('Message', '')
+
 class DataAccessLayer:
 
-    def __init__(self, database_name, db_cluster_arn, db_credentials_secrets_store_arn):
-        self._rdsdata_client = boto3.client('rds-data')
+    def __init__(self, database_name, db_cluster_arn, db_credentials_secrets_store_arn, hedge_policy=None, circuit_breaker=None,
+                 rdsdata_client=None):
+        self._rdsdata_client = rdsdata_client if rdsdata_client is not None else get_rdsdata_client()
         self._database_name = database_name
         self._db_cluster_arn = db_cluster_arn
         self._db_credentials_secrets_store_arn = db_credentials_secrets_store_arn
+        # opt-in hedged reads (see helper/hedging.py): primary and hedge requests run on this pool
+        self._hedge_policy = hedge_policy
+        self._hedge_executor = ThreadPoolExecutor(max_workers=8) if hedge_policy is not None else None
+        # opt-in circuit breaker (see helper/circuitbreaker.py): fails fast while the database is unavailable
+        self._circuit_breaker = circuit_breaker
 
     @staticmethod
     def _xray_start(segment_name):
@@ -61,7 +141,50 @@ class DataAccessLayer:
         if is_lambda_environment and xray_recorder and xray_recorder.current_subsegment():
             return xray_recorder.current_subsegment().put_metadata(name, value)
 
-    def execute_statement(self, sql_stmt, sql_params=[], transaction_id=None):
+    def _call_rdsdata(self, operation, **parameters):
+        if self._circuit_breaker is None:
+            return operation(**parameters)
+        self._circuit_breaker.before_call()
+        start_time = time.monotonic()
+        try:
+            result = operation(**parameters)
+        except Exception as e:
+            self._circuit_breaker.record_call((time.monotonic() - start_time) * 1000, e)
+            raise e
+        self._circuit_breaker.record_call((time.monotonic() - start_time) * 1000)
+        return result
+
+    def _execute_hedged_statement(self, **parameters):
+        # Fires a duplicate request if the first one is slower than the hedge delay and returns the
+        # first successful response; the other request is cancelled if not started yet, else ignored
+        start_time = time.monotonic()
+        primary = self._hedge_executor.submit(self._rdsdata_client.execute_statement, **parameters)
+        # the hedge delay tracks the latency of primary requests: latencies cut short by hedges would
+        # lower it, so more requests would be hedged and it would drift down further
+        def record_primary_latency(request):
+            if not request.cancelled():
+                self._hedge_policy.record_request((time.monotonic() - start_time) * 1000)
+        primary.add_done_callback(record_primary_latency)
+        requests = [primary]
+        done, _ = wait(requests, timeout=self._hedge_policy.delay_ms() / 1000)
+        if len(done) == 0 and self._hedge_policy.try_acquire_hedge():
+            requests.append(self._hedge_executor.submit(self._rdsdata_client.execute_statement, **parameters))
+        pending = requests
+        winner = None
+        while winner is None and len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((request for request in done if request.exception() is None), None)
+        for request in pending:
+            request.cancel()
+        if winner is not None and winner is not primary:
+            self._hedge_policy.record_hedge_win()
+        DataAccessLayer._xray_add_metadata('hedged', len(requests) > 1)
+        DataAccessLayer._xray_add_metadata('hedge_stats', self._hedge_policy.stats())
+        if winner is None:
+            raise primary.exception()
+        return winner.result()
+
+    def execute_statement(self, sql_stmt, sql_params=[], transaction_id=None, idempotent=False):
         parameters = f' with parameters: {sql_params}' if len(sql_params) > 0 else ''
         logger.debug(f'Running SQL statement: {sql_stmt}{parameters}')
         DataAccessLayer._xray_start('execute_statement')
@@ -76,7 +199,12 @@ class DataAccessLayer:
             }
             if transaction_id is not None:
                 parameters['transactionId'] = transaction_id
-            result = self._rdsdata_client.execute_statement(**parameters)
+            hedged = idempotent and self._hedge_policy is not None and transaction_id is None \
+                and sql_stmt.lstrip().lower().startswith('select')
+            if hedged:
+                result = self._call_rdsdata(self._execute_hedged_statement, **parameters)
+            else:
+                result = self._call_rdsdata(self._rdsdata_client.execute_statement, **parameters)
         except Exception as e:
             logger.debug(f'Error running SQL statement (error class: {e.__class__})')
             raise DataAccessLayerException(e) from e
@@ -86,41 +214,197 @@ class DataAccessLayer:
         finally:
            DataAccessLayer._xray_stop()
 
+    def begin_transaction(self):
+        try:
+            response = self._call_rdsdata(self._rdsdata_client.begin_transaction,
+                secretArn=self._db_credentials_secrets_store_arn,
+                database=self._database_name,
+                resourceArn=self._db_cluster_arn)
+            return response['transactionId']
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+
+    def commit_transaction(self, transaction_id):
+        try:
+            return self._call_rdsdata(self._rdsdata_client.commit_transaction,
+                secretArn=self._db_credentials_secrets_store_arn,
+                resourceArn=self._db_cluster_arn,
+                transactionId=transaction_id)
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+
+    def rollback_transaction(self, transaction_id):
+        try:
+            return self._call_rdsdata(self._rdsdata_client.rollback_transaction,
+                secretArn=self._db_credentials_secrets_store_arn,
+                resourceArn=self._db_cluster_arn,
+                transactionId=transaction_id)
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+
     def batch_execute_statement(self, sql_stmt, sql_param_sets, batch_size, transaction_id=None):
-        parameters = f' with parameters: {sql_param_sets}' if len(sql_param_sets) > 0 else ''
-        logger.debug(f'Running SQL statement: {sql_stmt}{parameters}')
+        # sql_param_sets may be any iterable (eg, a generator): it is consumed batch_size parameter
+        # sets at a time, so only one batch of parameter sets is in memory at once
+        logger.debug(f'Running SQL statement: {sql_stmt}')
         DataAccessLayer._xray_start('batch_execute_statement')
         try:
-            array_length = len(sql_param_sets)
-            num_batches = 1 + len(sql_param_sets)//batch_size
+            DataAccessLayer._xray_add_metadata('sql_statement', sql_stmt)
+            sql_param_sets = iter(sql_param_sets)
             results = []
-            for i in range(0, num_batches):
-                start_idx = i*batch_size
-                end_idx = min(start_idx + batch_size, array_length)
-                batch_sql_param_sets = sql_param_sets[start_idx:end_idx]
-                if len(batch_sql_param_sets) > 0:
-                    print(f'Running SQL statement: [batch #{i+1}/{num_batches}, batch size {batch_size}, SQL: {sql_stmt}]')
-                    DataAccessLayer._xray_add_metadata('sql_statement', sql_stmt)
-                    parameters = {
-                        'secretArn': self._db_credentials_secrets_store_arn,
-                        'database': self._database_name,
-                        'resourceArn': self._db_cluster_arn,
-                        'sql': sql_stmt,
-                        'parameterSets': batch_sql_param_sets
-                    }
-                    if transaction_id is not None:
-                        parameters['transactionId'] = transaction_id
-                    result = self._rdsdata_client.batch_execute_statement(**parameters)
-                    results.append(result)
+            batch_number = 0
+            while True:
+                batch_sql_param_sets = list(islice(sql_param_sets, batch_size))
+                if len(batch_sql_param_sets) == 0:
+                    break
+                batch_number += 1
+                print(f'Running SQL statement: [batch #{batch_number}, batch size {len(batch_sql_param_sets)}, SQL: {sql_stmt}]')
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f'Batch #{batch_number} parameters: {batch_sql_param_sets}')
+                parameters = {
+                    'secretArn': self._db_credentials_secrets_store_arn,
+                    'database': self._database_name,
+                    'resourceArn': self._db_cluster_arn,
+                    'sql': sql_stmt,
+                    'parameterSets': batch_sql_param_sets
+                }
+                if transaction_id is not None:
+                    parameters['transactionId'] = transaction_id
+                result = self._call_rdsdata(self._rdsdata_client.batch_execute_statement, **parameters)
+                DataAccessLayer._xray_add_metadata('rdsdata_executesql_result', json.dumps(result))
+                results.append(result)
         except Exception as e:
             logger.debug(f'Error running SQL statement (error class: {e.__class__})')
             raise DataAccessLayerException(e) from e
         else:
-            DataAccessLayer._xray_add_metadata('rdsdata_executesql_result', json.dumps(result))
             return results
         finally:
            DataAccessLayer._xray_stop()
 
+    @staticmethod
+    def _field_value(field):
+        if field.get('isNull'):
+            return None
+        return next(iter(field.values()))
+
+    #-----------------------------------------------------------------------------------------------
+    # Table Scan Functions
+    #-----------------------------------------------------------------------------------------------
+    def scan_table(self, table_name, columns, key_columns, after_key=None, lower_bound=None, upper_bound=None, limit=1000):
+        # Keyset pagination over the (string) primary key columns: each page is an index range scan
+        # starting right after the last key of the previous page, so cost does not grow with depth
+        DataAccessLayer._xray_start('scan_table')
+        try:
+            DataAccessLayer._xray_add_metadata('table_name', table_name)
+            conditions = []
+            sql_parameters = []
+            if lower_bound is not None:
+                conditions.append(f'{key_columns[0]} >= :lower_bound')
+                sql_parameters.append({'name':'lower_bound', 'value':{'stringValue': lower_bound}})
+            if upper_bound is not None:
+                conditions.append(f'{key_columns[0]} < :upper_bound')
+                sql_parameters.append({'name':'upper_bound', 'value':{'stringValue': upper_bound}})
+            if after_key is not None:
+                # (k0, k1, ...) > (a0, a1, ...) expanded so MySQL can range-scan the key index
+                terms = []
+                for i, key_column in enumerate(key_columns):
+                    equals = [ f'{key_columns[j]}=:after_key_{j}' for j in range(i) ]
+                    terms.append(' and '.join(equals + [f'{key_column}>:after_key_{i}']))
+                    sql_parameters.append({'name':f'after_key_{i}', 'value':{'stringValue': after_key[i]}})
+                conditions.append(f'{key_columns[0]}>=:after_key_0 and (({") or (".join(terms)}))')
+            where = f' where {" and ".join(conditions)}' if len(conditions) > 0 else ''
+            sql = f'select {", ".join(columns)}' \
+                f' from {table_name}{where}' \
+                f' order by {", ".join(key_columns)}' \
+                f' limit {int(limit)}'
+            response = self.execute_statement(sql, sql_parameters)
+            return [ [ DataAccessLayer._field_value(field) for field in record ] for record in response['records'] ]
+        except DataAccessLayerException as de:
+            raise de
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+        finally:
+            DataAccessLayer._xray_stop()
+
+    def find_key_splits(self, table_name, key_column, num_partitions):
+        # Split points dividing the table into num_partitions key ranges of similar row counts, taken
+        # from a random sample of its keys read in one pass over the key index (OFFSET would scan the
+        # index up to every split point)
+        DataAccessLayer._xray_start('find_key_splits')
+        try:
+            response = self.execute_statement(f'select count(*) from {table_name}')
+            num_rows = response['records'][0][0]['longValue']
+            splits = []
+            if num_rows // max(1, num_partitions) == 0:
+                return splits
+            sample_fraction = min(1.0, num_partitions * key_split_samples_per_partition / num_rows)
+            sql_parameters = [
+                {'name':'sample_fraction', 'value':{'doubleValue': sample_fraction}}
+            ]
+            sql = f'select {key_column} from {table_name}' \
+                f' where rand() < :sample_fraction' \
+                f' order by {key_column}'
+            response = self.execute_statement(sql, sql_parameters)
+            keys = [ record[0]['stringValue'] for record in response['records'] ]
+            for i in range(1, num_partitions):
+                if len(keys) == 0:
+                    break
+                split = keys[i * len(keys) // num_partitions]
+                if split not in splits:
+                    splits.append(split)
+            return splits
+        except DataAccessLayerException as de:
+            raise de
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+        finally:
+            DataAccessLayer._xray_stop()
+
+    #-----------------------------------------------------------------------------------------------
+    # Warm-up Functions
+    #-----------------------------------------------------------------------------------------------
+    def ping(self):
+        DataAccessLayer._xray_start('ping')
+        try:
+            # cheapest possible round trip: resumes Aurora Serverless if paused
+            return self.execute_statement('select 1')
+        finally:
+            DataAccessLayer._xray_stop()
+
+    #-----------------------------------------------------------------------------------------------
+    # Rate Limiting Functions
+    #-----------------------------------------------------------------------------------------------
+    def sync_tokens(self, bucket_key, cost, rate_per_sec, capacity):
+        # Token bucket shared by all Lambda containers: debits the cost of the requests a container
+        # admitted since its last sync (the level may go negative, so over-admissions are paid back)
+        # and returns the current level. Refills use the database clock. Two autocommit statements,
+        # so the bucket row is only locked for the duration of the upsert
+        DataAccessLayer._xray_start('sync_tokens')
+        try:
+            sql_parameters = [
+                {'name':'bucket_key', 'value':{'stringValue': bucket_key}},
+                {'name':'cost', 'value':{'doubleValue': cost}},
+                {'name':'rate_per_sec', 'value':{'doubleValue': rate_per_sec}},
+                {'name':'capacity', 'value':{'doubleValue': capacity}}
+            ]
+            refilled_tokens = 'least(:capacity, tokens + greatest(0, unix_timestamp(now(6)) - updated_at) * :rate_per_sec)'
+            # tokens is assigned before updated_at, so it is refilled from the previous update time
+            sql = f'insert into {token_bucket_table_name}' \
+                f' (bucket_key, tokens, updated_at)' \
+                f' values (:bucket_key, :capacity - :cost, unix_timestamp(now(6)))' \
+                f' on duplicate key update' \
+                f' tokens={refilled_tokens} - :cost,' \
+                f' updated_at=greatest(updated_at, unix_timestamp(now(6)))'
+            self.execute_statement(sql, sql_parameters)
+            sql = f'select {refilled_tokens} from {token_bucket_table_name} where bucket_key=:bucket_key'
+            response = self.execute_statement(sql, [ p for p in sql_parameters if p['name'] != 'cost' ])
+            return float(DataAccessLayer._field_value(response['records'][0][0]))
+        except DataAccessLayerException as de:
+            raise de
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+        finally:
+            DataAccessLayer._xray_stop()
+
     #-----------------------------------------------------------------------------------------------
     # Package Functions
     #-----------------------------------------------------------------------------------------------
@@ -135,7 +419,7 @@ class DataAccessLayer:
                 f' from {package_table_name}' \
                 f' where package_name=:package_name' \
                 f' and package_version=:package_version'
-            response = self.execute_statement(sql, sql_parameters)
+            response = self.execute_statement(sql, sql_parameters, idempotent=True)
             results = [
                 {
                     'package_name': record[0]['stringValue'],
@@ -167,17 +451,17 @@ class DataAccessLayer:
         finally:
             DataAccessLayer._xray_stop()
 
-    def _save_packages_batch(self, package_list, batch_size=200, ignore_key_conflict=True):
+    def save_packages_batch(self, package_list, batch_size=200, ignore_key_conflict=True):
         DataAccessLayer._xray_start('save_packages_batch')
         try:
             ignore = 'ignore' if ignore_key_conflict else ''
-            sql_parameter_sets = []
-            for package in package_list:
-                sql_parameters = [
+            sql_parameter_sets = (
+                [
                     {'name':'package_name', 'value':{'stringValue': package['package_name']}},
                     {'name':'package_version', 'value':{'stringValue': package['package_version']}}
                 ]
-                sql_parameter_sets.append(sql_parameters)
+                for package in package_list
+            )
             sql = f'insert {ignore} into {package_table_name}' \
                 f' (package_name, package_version)' \
                 f' values (:package_name, :package_version)'
@@ -198,7 +482,7 @@ class DataAccessLayer:
             sql = f'select aws_instance_id, package_name, package_version' \
                 f' from {ec2_package_table_name}' \
                 f' where aws_instance_id=:aws_instance_id'
-            response = self.execute_statement(sql, sql_parameters)
+            response = self.execute_statement(sql, sql_parameters, idempotent=True)
             results = [
                 {
                     'aws_instance_id': record[0]['stringValue'],
@@ -211,6 +495,27 @@ class DataAccessLayer:
         finally:
             DataAccessLayer._xray_stop()
 
+    def _find_saved_ec2_package_relations(self, aws_instance_id, package_list, transaction_id):
+        # (package_name, package_version) of the relations of package_list already saved, locked until
+        # the transaction ends; a range scan of the primary key over the package names
+        DataAccessLayer._xray_start('find_saved_ec2_package_relations')
+        try:
+            package_names = sorted({ package['package_name'] for package in package_list })
+            sql_parameters = [
+                {'name':f'package_name_{i}', 'value':{'stringValue': package_name}}
+                for i, package_name in enumerate(package_names)
+            ]
+            sql = f'select package_name, package_version' \
+                f' from {ec2_package_table_name}' \
+                f' where aws_instance_id=:aws_instance_id' \
+                f' and package_name in ({", ".join(":" + p["name"] for p in sql_parameters)})' \
+                f' for update'
+            sql_parameters.append({'name':'aws_instance_id', 'value':{'stringValue': aws_instance_id}})
+            response = self.execute_statement(sql, sql_parameters, transaction_id)
+            return { (record[0]['stringValue'], record[1]['stringValue']) for record in response['records'] }
+        finally:
+            DataAccessLayer._xray_stop()
+
     def _save_ec2_package_relation(self, aws_instance_id, package_name, package_version):
         DataAccessLayer._xray_start('save_ec2_package_relation')
         try:
@@ -227,18 +532,39 @@ class DataAccessLayer:
         finally:
             DataAccessLayer._xray_stop()
 
-    def _save_ec2_package_relations_batch(self, aws_instance_id, package_list, batch_size=200, ignore_key_conflict=True):
+    def _save_ec2_package_relations_batch(self, aws_instance_id, package_list, batch_size=200, ignore_key_conflict=True, transaction_id=None):
         DataAccessLayer._xray_start('save_ec2_package_relations_batch')
         try:
             ignore = 'ignore' if ignore_key_conflict else ''
-            sql_parameter_sets = []
-            for package in package_list:
-                sql_parameters = [
+            sql_parameter_sets = (
+                [
                     {'name':'aws_instance_id', 'value':{'stringValue': aws_instance_id}},
                     {'name':'package_name', 'value':{'stringValue': package['package_name']}},
                     {'name':'package_version', 'value':{'stringValue': package['package_version']}}
                 ]
-                sql_parameter_sets.append(sql_parameters)
+                for package in package_list
+            )
+            sql = f'insert {ignore} into {ec2_package_table_name}' \
+                f' (aws_instance_id, package_name, package_version)' \
+                f' values (:aws_instance_id, :package_name, :package_version)'
+            response = self.batch_execute_statement(sql, sql_parameter_sets, batch_size, transaction_id)
+            return response
+        finally:
+            DataAccessLayer._xray_stop()
+
+    def save_relations_batch(self, relation_list, batch_size=200, ignore_key_conflict=True):
+        # relations of any number of EC2 instances (eg, bulk loads)
+        DataAccessLayer._xray_start('save_relations_batch')
+        try:
+            ignore = 'ignore' if ignore_key_conflict else ''
+            sql_parameter_sets = (
+                [
+                    {'name':'aws_instance_id', 'value':{'stringValue': relation['aws_instance_id']}},
+                    {'name':'package_name', 'value':{'stringValue': relation['package_name']}},
+                    {'name':'package_version', 'value':{'stringValue': relation['package_version']}}
+                ]
+                for relation in relation_list
+            )
             sql = f'insert {ignore} into {ec2_package_table_name}' \
                 f' (aws_instance_id, package_name, package_version)' \
                 f' values (:aws_instance_id, :package_name, :package_version)'
@@ -260,7 +586,7 @@ class DataAccessLayer:
             sql = f'select aws_instance_id, aws_region, aws_account' \
                   f' from {ec2_table_name}' \
                   f' where aws_instance_id=:aws_instance_id'
-            response = self.execute_statement(sql, sql_parameters)
+            response = self.execute_statement(sql, sql_parameters, idempotent=True)
             record = dict()
             returned_records = response['records']
             if len(returned_records) > 0:
@@ -278,27 +604,193 @@ class DataAccessLayer:
         finally:
            DataAccessLayer._xray_stop()
 
+    def find_ec2s_completed_since(self, since, after_key=None, limit=100, after_package=None, max_packages=None):
+        # Change feed: EC2s (with their packages) completed at or after since, in (completion_date_utc,
+        # aws_instance_id) order. EC2s whose packages are still being saved have no completion date
+        # and are left out until they have them all. Keyset pagination on completion_date_utc_idx,
+        # which InnoDB suffixes with the primary key, so each page is an index range scan whatever
+        # the table size. after_key is the (completion_date_utc, aws_instance_id) of the last EC2 of
+        # the previous page.
+        # A page holds at most max_packages package rows: it ends early if needed, and an EC2 with
+        # more packages than fit is split across pages. Its record then has more_packages set, and the
+        # next page starts with the same EC2, after after_package (its last (package_name, package_version)).
+        # Returns (records, has_more)
+        DataAccessLayer._xray_start('find_ec2s_completed_since')
+        try:
+            max_packages = max_packages if max_packages is not None else change_feed_max_packages
+            DataAccessLayer._xray_add_metadata('since', since)
+            conditions = [
+                'completion_date_utc>=:since',
+                f'completion_date_utc<current_timestamp - interval {int(change_feed_settle_secs)} second'
+            ]
+            sql_parameters = [
+                {'name':'since', 'value':{'stringValue': since}}
+            ]
+            if after_key is not None:
+                # the EC2 of after_key is listed again when its packages continue on this page
+                after_id_comparison = '>=' if after_package is not None else '>'
+                conditions.append('completion_date_utc>=:after_date'
+                    f' and (completion_date_utc>:after_date or (completion_date_utc=:after_date and aws_instance_id{after_id_comparison}:after_id))')
+                sql_parameters.append({'name':'after_date', 'value':{'stringValue': after_key[0]}})
+                sql_parameters.append({'name':'after_id', 'value':{'stringValue': after_key[1]}})
+            sql = f'select aws_instance_id, aws_region, aws_account, creation_date_utc, completion_date_utc' \
+                f' from {ec2_table_name}' \
+                f' where {" and ".join(conditions)}' \
+                f' order by completion_date_utc, aws_instance_id' \
+                f' limit {int(limit)}'
+            response = self.execute_statement(sql, sql_parameters, idempotent=True)
+            records = [
+                {
+                    'aws_instance_id': record[0]['stringValue'],
+                    'aws_region': record[1]['stringValue'],
+                    'aws_account': record[2]['stringValue'],
+                    'creation_date_utc': record[3]['stringValue'],
+                    'completion_date_utc': record[4]['stringValue'],
+                    'packages': [],
+                    'more_packages': False
+                }
+                for record in response['records']
+            ]
+            DataAccessLayer._xray_add_metadata('num_ec2s', len(records))
+            if len(records) == 0:
+                return records, False
+            has_more = len(records) == limit
+            # packages EC2 by EC2 in page order, each a range scan of the ec2_package primary key for
+            # at most one row more than still fits (to know whether the EC2 has more), so a page reads
+            # about max_packages rows whatever the number of packages of its EC2s
+            num_packages_left = max_packages
+            for index, record in enumerate(records):
+                conditions = ['aws_instance_id=:aws_instance_id']
+                sql_parameters = [
+                    {'name':'aws_instance_id', 'value':{'stringValue': record['aws_instance_id']}}
+                ]
+                if index == 0 and after_package is not None and record['aws_instance_id'] == after_key[1]:
+                    conditions.append('(package_name>:after_name or (package_name=:after_name and package_version>:after_version))')
+                    sql_parameters.append({'name':'after_name', 'value':{'stringValue': after_package[0]}})
+                    sql_parameters.append({'name':'after_version', 'value':{'stringValue': after_package[1]}})
+                sql = f'select package_name, package_version' \
+                    f' from {ec2_package_table_name}' \
+                    f' where {" and ".join(conditions)}' \
+                    f' order by package_name, package_version' \
+                    f' limit {int(num_packages_left) + 1}'
+                response = self.execute_statement(sql, sql_parameters, idempotent=True)
+                package_records = response['records']
+                record['more_packages'] = len(package_records) > num_packages_left
+                record['packages'] = [
+                    {
+                        'package_name': package_record[0]['stringValue'],
+                        'package_version': package_record[1]['stringValue']
+                    }
+                    for package_record in package_records[:num_packages_left]
+                ]
+                num_packages_left -= len(record['packages'])
+                if num_packages_left == 0 and (record['more_packages'] or index < len(records) - 1):
+                    # end the page with this EC2
+                    records = records[:index + 1]
+                    has_more = True
+                    break
+            return records, has_more
+        except DataAccessLayerException as de:
+            raise de
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+        finally:
+            DataAccessLayer._xray_stop()
+
+    def save_ec2_batch(self, ec2_list, batch_size=200, ignore_key_conflict=True):
+        DataAccessLayer._xray_start('save_ec2_batch')
+        try:
+            ignore = 'ignore' if ignore_key_conflict else ''
+            sql_parameter_sets = (
+                [
+                    {'name':'aws_instance_id', 'value':{'stringValue': ec2['aws_instance_id']}},
+                    {'name':'aws_region', 'value':{'stringValue': ec2['aws_region']}},
+                    {'name':'aws_account', 'value':{'stringValue': ec2['aws_account']}}
+                ]
+                for ec2 in ec2_list
+            )
+            sql = f'insert {ignore} into {ec2_table_name}' \
+                f' (aws_instance_id, aws_region, aws_account)' \
+                f' values (:aws_instance_id, :aws_region, :aws_account)'
+            response = self.batch_execute_statement(sql, sql_parameter_sets, batch_size)
+            return response
+        finally:
+            DataAccessLayer._xray_stop()
+
+    def complete_ec2_batch(self, aws_instance_id_list, batch_size=200):
+        # Marks EC2s whose packages are all saved (eg, after bulk loading their relations) so the change
+        # feed lists them; EC2s already complete keep their completion date, so replays are harmless
+        DataAccessLayer._xray_start('complete_ec2_batch')
+        try:
+            sql_parameter_sets = (
+                [
+                    {'name':'aws_instance_id', 'value':{'stringValue': aws_instance_id}}
+                ]
+                for aws_instance_id in aws_instance_id_list
+            )
+            sql = f'update {ec2_table_name}' \
+                f' set completion_date_utc=current_timestamp' \
+                f' where aws_instance_id=:aws_instance_id and completion_date_utc is null'
+            response = self.batch_execute_statement(sql, sql_parameter_sets, batch_size)
+            return response
+        finally:
+            DataAccessLayer._xray_stop()
+
     def save_ec2(self, aws_instance_id, input_fields, batch_size=200):
+        # input_fields['packages'] may be any iterable (eg, Ec2Payload.iter_packages()): packages are
+        # written batch_size at a time, each chunk's packages before the relations referencing them,
+        # so memory use does not grow with the number of packages. The EC2 is marked complete (and
+        # enters the change feed) once its last chunk is saved. Saving an EC2 whose earlier save failed
+        # before completing it resumes that save (relations are inserted with 'insert ignore'); saving
+        # a complete EC2 again fails with a duplicate key error
         DataAccessLayer._xray_start('save_ec2')
         try:
-            num_ec2_packages = len(input_fields['packages']) if 'packages' in input_fields else 0
             DataAccessLayer._xray_add_metadata('aws_instance_id', aws_instance_id)
-            DataAccessLayer._xray_add_metadata('num_ec2_packages', num_ec2_packages)
-            # packages have their own table, so remove it to construct the ec2 record
-            ec2_fields = input_fields.copy()
-            ec2_fields.pop('packages')
             sql_parameters = [
                 {'name':'aws_instance_id', 'value':{'stringValue': aws_instance_id}},
-                {'name':'aws_region', 'value':{'stringValue': ec2_fields['aws_region']}},
-                {'name':'aws_account', 'value':{'stringValue': ec2_fields['aws_account']}},
+                {'name':'aws_region', 'value':{'stringValue': input_fields['aws_region']}},
+                {'name':'aws_account', 'value':{'stringValue': input_fields['aws_account']}},
             ]
             sql = f'insert into {ec2_table_name}' \
                 f' (aws_instance_id, aws_region, aws_account)' \
                 f' values (:aws_instance_id, :aws_region, :aws_account)'
-            response = self.execute_statement(sql, sql_parameters)
-            if 'packages' in input_fields:
-                self._save_packages_batch(input_fields['packages'], batch_size)
-                self._save_ec2_package_relations_batch(aws_instance_id, input_fields['packages'], batch_size)
+            resumed = False
+            try:
+                response = self.execute_statement(sql, sql_parameters)
+            except DataAccessLayerException as de:
+                if not is_duplicate_key_error(de.original_exception):
+                    raise de
+                sql = f'select aws_region, aws_account' \
+                    f' from {ec2_table_name}' \
+                    f' where aws_instance_id=:aws_instance_id and completion_date_utc is null'
+                response = self.execute_statement(sql, sql_parameters[:1])
+                if len(response['records']) == 0:
+                    raise de
+                # the summary counts the EC2 where it was first saved
+                input_fields = dict(input_fields,
+                    aws_region=response['records'][0][0]['stringValue'], aws_account=response['records'][0][1]['stringValue'])
+                resumed = True
+                logger.warning(f'Resuming incomplete save of EC2 {aws_instance_id}')
+            DataAccessLayer._xray_add_metadata('resumed', resumed)
+            num_ec2_packages = 0
+            # a host counts once per package version, whatever duplicates the input has
+            summarized_packages = PackageSet() if package_version_summary_enabled else None
+            packages = iter(input_fields.get('packages', []))
+            for package_chunk in iter(lambda: list(islice(packages, batch_size)), []):
+                self.save_packages_batch(package_chunk, batch_size)
+                if summarized_packages is None:
+                    self._save_ec2_package_relations_batch(aws_instance_id, package_chunk, batch_size)
+                else:
+                    new_packages = [ package for package in package_chunk
+                        if summarized_packages.add(package['package_name'], package['package_version']) ]
+                    self._save_summarized_ec2_package_relations(aws_instance_id, input_fields['aws_region'], input_fields['aws_account'],
+                                                                package_chunk, new_packages, batch_size, resumed)
+                num_ec2_packages += len(package_chunk)
+            sql = f'update {ec2_table_name}' \
+                f' set completion_date_utc=current_timestamp' \
+                f' where aws_instance_id=:aws_instance_id'
+            self.execute_statement(sql, sql_parameters[:1])
+            DataAccessLayer._xray_add_metadata('num_ec2_packages', num_ec2_packages)
             return response
         except DataAccessLayerException as de:
             raise de
@@ -306,3 +798,124 @@ class DataAccessLayer:
             raise DataAccessLayerException(e) from e
         finally:
            DataAccessLayer._xray_stop()
+
+    #-----------------------------------------------------------------------------------------------
+    # Aggregation Functions
+    #-----------------------------------------------------------------------------------------------
+    def _save_summarized_ec2_package_relations(self, aws_instance_id, aws_region, aws_account, package_list, new_package_list,
+                                               batch_size=200, resumed=False):
+        # Relations and the summary increments for the EC2's new package versions commit together, so
+        # a save failing midway does not leave the summary out of line with ec2_package. When resuming
+        # a save, package versions whose relations were committed by the earlier attempt are not counted again
+        transaction_id = self.begin_transaction()
+        try:
+            if resumed and len(new_package_list) > 0:
+                saved_relations = self._find_saved_ec2_package_relations(aws_instance_id, new_package_list, transaction_id)
+                new_package_list = [ package for package in new_package_list
+                    if (package['package_name'], package['package_version']) not in saved_relations ]
+            self._save_ec2_package_relations_batch(aws_instance_id, package_list, batch_size, transaction_id=transaction_id)
+            self._increment_package_version_summary(aws_region, aws_account, new_package_list, batch_size, transaction_id)
+            self.commit_transaction(transaction_id)
+            transaction_id = None
+        finally:
+            if transaction_id is not None:
+                self.rollback_transaction(transaction_id)
+
+    def _increment_package_version_summary(self, aws_region, aws_account, package_list, batch_size=200, transaction_id=None):
+        DataAccessLayer._xray_start('increment_package_version_summary')
+        try:
+            sql_parameter_sets = []
+            # a host counts once per package version, whatever duplicates the input has
+            for package_name, package_version in { (package['package_name'], package['package_version']) for package in package_list }:
+                sql_parameters = [
+                    {'name':'package_name', 'value':{'stringValue': package_name}},
+                    {'name':'package_version', 'value':{'stringValue': package_version}},
+                    {'name':'aws_region', 'value':{'stringValue': aws_region}},
+                    {'name':'aws_account', 'value':{'stringValue': aws_account}}
+                ]
+                sql_parameter_sets.append(sql_parameters)
+            sql = f'insert into {package_version_summary_table_name}' \
+                f' (package_name, package_version, aws_region, aws_account, host_count)' \
+                f' values (:package_name, :package_version, :aws_region, :aws_account, 1)' \
+                f' on duplicate key update host_count=host_count+1'
+            response = self.batch_execute_statement(sql, sql_parameter_sets, batch_size, transaction_id)
+            return response
+        finally:
+            DataAccessLayer._xray_stop()
+
+    def rebuild_package_version_summary(self):
+        # Recomputes the summary from the base tables, eg, after bulk loads or enabling it on existing data.
+        # Delete and insert run in one transaction so readers never see an empty or partial summary
+        DataAccessLayer._xray_start('rebuild_package_version_summary')
+        transaction_id = None
+        try:
+            transaction_id = self.begin_transaction()
+            self.execute_statement(f'delete from {package_version_summary_table_name}', transaction_id=transaction_id)
+            sql = f'insert into {package_version_summary_table_name}' \
+                f' (package_name, package_version, aws_region, aws_account, host_count)' \
+                f' select ep.package_name, ep.package_version, e.aws_region, e.aws_account, count(distinct e.aws_instance_id)' \
+                f' from {ec2_package_table_name} ep' \
+                f' join {ec2_table_name} e on e.aws_instance_id=ep.aws_instance_id' \
+                f' group by ep.package_name, ep.package_version, e.aws_region, e.aws_account'
+            response = self.execute_statement(sql, transaction_id=transaction_id)
+            self.commit_transaction(transaction_id)
+            transaction_id = None
+            return response
+        except DataAccessLayerException as de:
+            raise de
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+        finally:
+            if transaction_id is not None:
+                self.rollback_transaction(transaction_id)
+            DataAccessLayer._xray_stop()
+
+    def count_hosts_by_package_version(self, package_name, group_by=[], aws_region=None, aws_account=None,
+                                       created_after=None, created_before=None):
+        # Host count per version of package_name, optionally broken down by region and/or account.
+        # Served from the summary table when enabled and no creation date filter is given; otherwise
+        # aggregated from ec2_package (package index) joined with ec2 (primary key)
+        DataAccessLayer._xray_start('count_hosts_by_package_version')
+        try:
+            for column in group_by:
+                if column not in package_version_group_by_columns:
+                    raise ValueError(f'Invalid group by column: {column}')
+            DataAccessLayer._xray_add_metadata('package_name', package_name)
+            use_summary = package_version_summary_enabled and created_after is None and created_before is None
+            filters = [('package_name', package_name, '='), ('aws_region', aws_region, '='), ('aws_account', aws_account, '='),
+                ('creation_date_utc', created_after, '>='), ('creation_date_utc', created_before, '<')]
+            conditions = []
+            sql_parameters = []
+            for i, (column, value, operator) in enumerate(filters):
+                if value is not None:
+                    table_alias = 's' if use_summary else ('ep' if column == 'package_name' else 'e')
+                    conditions.append(f'{table_alias}.{column}{operator}:filter_{i}')
+                    sql_parameters.append({'name':f'filter_{i}', 'value':{'stringValue': value}})
+            if use_summary:
+                group_by_columns = ['s.package_version'] + [ f's.{column}' for column in group_by ]
+                sql = f'select {", ".join(group_by_columns)}, sum(s.host_count)' \
+                    f' from {package_version_summary_table_name} s'
+            else:
+                group_by_columns = ['ep.package_version'] + [ f'e.{column}' for column in group_by ]
+                sql = f'select {", ".join(group_by_columns)}, count(distinct e.aws_instance_id)' \
+                    f' from {ec2_package_table_name} ep' \
+                    f' join {ec2_table_name} e on e.aws_instance_id=ep.aws_instance_id'
+            sql = f'{sql} where {" and ".join(conditions)}' \
+                f' group by {", ".join(group_by_columns)}' \
+                f' order by {", ".join(group_by_columns)}'
+            response = self.execute_statement(sql, sql_parameters, idempotent=True)
+            columns = ['package_version'] + group_by
+            results = []
+            for record in response['records']:
+                result = { column: DataAccessLayer._field_value(record[i]) for i, column in enumerate(columns) }
+                result['host_count'] = int(DataAccessLayer._field_value(record[len(columns)]))
+                results.append(result)
+            return results
+        except DataAccessLayerException as de:
+            raise de
+        except ValueError as ve:
+            raise ve
+        except Exception as e:
+            raise DataAccessLayerException(e) from e
+        finally:
+            DataAccessLayer._xray_stop()
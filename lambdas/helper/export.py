@@ -0,0 +1,144 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import json
+import time
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from .dal import ec2_table_name, package_table_name, ec2_package_table_name
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Columns exported per table and the primary key columns used for keyset pagination
+export_table_specs = {
+    ec2_table_name: {
+        'columns': ['aws_instance_id', 'aws_region', 'aws_account', 'creation_date_utc', 'completion_date_utc'],
+        'key_columns': ['aws_instance_id']
+    },
+    package_table_name: {
+        'columns': ['package_name', 'package_version'],
+        'key_columns': ['package_name', 'package_version']
+    },
+    ec2_package_table_name: {
+        'columns': ['aws_instance_id', 'package_name', 'package_version'],
+        'key_columns': ['aws_instance_id', 'package_name', 'package_version']
+    }
+}
+
+#-----------------------------------------------------------------------------------------------
+# Chunk Formats
+#-----------------------------------------------------------------------------------------------
+def ndjson_chunk(columns, rows):
+    return ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+def columnar_chunk(columns, rows):
+    # one array per column, Parquet-style, so consumers can load a column without parsing every row
+    data = { column: [ row[i] for row in rows ] for i, column in enumerate(columns) }
+    return json.dumps({'num_rows': len(rows), 'columns': columns, 'data': data})
+
+export_formats = {
+    'ndjson': {'extension': 'ndjson', 'chunk': ndjson_chunk},
+    'columnar': {'extension': 'columnar.json', 'chunk': columnar_chunk}
+}
+
+#-----------------------------------------------------------------------------------------------
+# Chunk Writers
+#-----------------------------------------------------------------------------------------------
+class S3ChunkWriter:
+
+    def __init__(self, bucket_name, prefix, s3_client=None):
+        self._s3_client = s3_client if s3_client is not None else boto3.client('s3')
+        self._bucket_name = bucket_name
+        self._prefix = prefix
+
+    def write(self, key, body):
+        # chunk keys are deterministic, so re-exporting a chunk after a retry overwrites it
+        object_key = f'{self._prefix}/{key}'
+        self._s3_client.put_object(Bucket=self._bucket_name, Key=object_key, Body=body.encode('utf-8'))
+        return object_key
+
+#-----------------------------------------------------------------------------------------------
+# Exporter
+#-----------------------------------------------------------------------------------------------
+def build_partitions(dal, tables, key_splits=None, partitions_per_table=1):
+    # A partition is a key range of a table plus its resumable cursor (last exported key, chunk number)
+    key_splits = key_splits if key_splits is not None else dict()
+    partitions = []
+    for table_name in tables:
+        first_key_column = export_table_specs[table_name]['key_columns'][0]
+        if table_name in key_splits:
+            splits = sorted(key_splits[table_name])
+        elif partitions_per_table > 1:
+            splits = dal.find_key_splits(table_name, first_key_column, partitions_per_table)
+        else:
+            splits = []
+        bounds = [None] + splits + [None]
+        for i in range(len(bounds) - 1):
+            partitions.append({
+                'partition_id': f'{table_name}-{i:04d}',
+                'table_name': table_name,
+                'lower_bound': bounds[i],
+                'upper_bound': bounds[i+1],
+                'after_key': None,
+                'next_chunk': 0,
+                'num_rows': 0,
+                'complete': False
+            })
+    return partitions
+
+class InventoryExporter:
+
+    def __init__(self, dal, writer, export_format='ndjson', page_size=1000, max_workers=4):
+        if export_format not in export_formats:
+            raise ValueError(f'Invalid export format: {export_format} (valid formats: {list(export_formats.keys())})')
+        self._dal = dal
+        self._writer = writer
+        self._export_format = export_formats[export_format]
+        self._page_size = page_size
+        self._max_workers = max_workers
+
+    def export_partition(self, export_id, partition, deadline):
+        # Streams one page at a time, so memory is bounded by page_size whatever the table size
+        table_spec = export_table_specs[partition['table_name']]
+        columns = table_spec['columns']
+        key_indexes = [ columns.index(key_column) for key_column in table_spec['key_columns'] ]
+        while not partition['complete'] and time.monotonic() < deadline:
+            rows = self._dal.scan_table(
+                partition['table_name'], columns, table_spec['key_columns'],
+                after_key=partition['after_key'],
+                lower_bound=partition['lower_bound'],
+                upper_bound=partition['upper_bound'],
+                limit=self._page_size)
+            if len(rows) > 0:
+                key = f'{export_id}/{partition["table_name"]}/{partition["partition_id"]}-{partition["next_chunk"]:06d}.{self._export_format["extension"]}'
+                self._writer.write(key, self._export_format['chunk'](columns, rows))
+                partition['after_key'] = [ rows[-1][i] for i in key_indexes ]
+                partition['next_chunk'] += 1
+                partition['num_rows'] += len(rows)
+            partition['complete'] = len(rows) < self._page_size
+        logger.info(f'Export {export_id} partition {partition["partition_id"]}: {partition["num_rows"]} rows, complete: {partition["complete"]}')
+        return partition
+
+    def run(self, export_id, partitions, deadline):
+        # Partitions are exported in parallel; the ones not complete by the deadline keep their
+        # cursor so a subsequent invocation can resume them
+        pending = [ partition for partition in partitions if not partition['complete'] ]
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for future in [ executor.submit(self.export_partition, export_id, partition, deadline) for partition in pending ]:
+                future.result()
+        return partitions
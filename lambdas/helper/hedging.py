@@ -0,0 +1,76 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import threading
+from collections import deque
+
+class HedgePolicy:
+    # Decides when to send a duplicate (hedge) request for an idempotent read: after the p-th
+    # percentile latency of recent calls, and only while the hedge budget allows it. Each request
+    # earns budget_ratio of a hedge (capped at max_budget), so hedges add at most ~budget_ratio
+    # extra load on the database.
+
+    def __init__(self, percentile=0.95, window_size=200, min_samples=20, default_delay_ms=100, min_delay_ms=5,
+                 budget_ratio=0.05, max_budget=10):
+        self._percentile = percentile
+        self._latencies_ms = deque(maxlen=window_size)
+        self._min_samples = min_samples
+        self._default_delay_ms = default_delay_ms
+        self._min_delay_ms = min_delay_ms
+        self._budget_ratio = budget_ratio
+        self._max_budget = max_budget
+        self._budget = 0.0
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_hedges = 0
+        self.num_hedge_wins = 0
+
+    def delay_ms(self):
+        with self._lock:
+            if len(self._latencies_ms) < self._min_samples:
+                return self._default_delay_ms
+            latencies_ms = sorted(self._latencies_ms)
+        idx = min(len(latencies_ms) - 1, int(len(latencies_ms) * self._percentile))
+        return max(self._min_delay_ms, latencies_ms[idx])
+
+    def record_request(self, latency_ms):
+        with self._lock:
+            self.num_requests += 1
+            self._latencies_ms.append(latency_ms)
+            self._budget = min(self._max_budget, self._budget + self._budget_ratio)
+
+    def try_acquire_hedge(self):
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            self.num_hedges += 1
+            return True
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.num_hedge_wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.num_requests,
+                'hedges': self.num_hedges,
+                'hedge_wins': self.num_hedge_wins,
+                'hedge_rate': self.num_hedges / self.num_requests if self.num_requests > 0 else 0.0,
+                'hedge_win_rate': self.num_hedge_wins / self.num_hedges if self.num_hedges > 0 else 0.0
+            }
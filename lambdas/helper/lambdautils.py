@@ -15,29 +15,66 @@
   SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import base64
+import binascii
 import json
 import uuid
 from .logger import get_logger
 from .dal import DataAccessLayerException
+from .admission import TooManyRequestsException, retry_after_header
+from .circuitbreaker import CircuitOpenException
 
 logger = get_logger(__name__)
 
 def key_missing_or_empty_value(d, key):
     return not key in d or not d[key]
 
+def is_warmup_event(event):
+    # scheduled keep-warm rules send {"warmup": true}; raw EventBridge events carry source=aws.events
+    return isinstance(event, dict) and (event.get('warmup') is True or event.get('source') == 'aws.events')
+
+def loggable_event(event):
+    # the body is left out: POST bodies can be several MB
+    if not isinstance(event, dict) or event.get('body') is None:
+        return event
+    loggable = {key: value for key, value in event.items() if key != 'body'}
+    loggable['body_length'] = len(event['body'])
+    return loggable
+
+def warm_up(dal):
+    dal.ping()
+    logger.info('Warm-up request completed')
+    return success({'warm': True})
+
+def encode_continuation_token(state):
+    # opaque to clients: URL-safe base64 of the JSON state needed to resume
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_continuation_token(token):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f'Invalid continuation token: {token}')
+    if not isinstance(state, dict):
+        raise ValueError(f'Invalid continuation token: {token}')
+    return state
+
 def success(output):
     return {
         'statusCode': 200,
         'body': json.dumps(output)
 }
 
-def error(error_code, error):
-    return {
+def error(error_code, error, headers=None):
+    response = {
         'statusCode': error_code,
         'body': json.dumps({
             'error_message': error
         })
     }
+    if headers is not None:
+        response['headers'] = headers
+    return response
 
 def handle_error(e):
     client_err_code = uuid.uuid4()
@@ -46,6 +83,14 @@ def handle_error(e):
         client_error_msg = f'{client_error_msg} - Error while validating input parameters: {e}'
         logger.error(f'[client error code: {client_err_code}, client error message: {client_error_msg}, internal error (ValueError)]')
         return error(400, client_error_msg)
+    elif isinstance(e, TooManyRequestsException):
+        client_error_msg = f'{client_error_msg} - Too many requests, please retry later'
+        logger.warning(f'[client error code: {client_err_code}, client error message: {client_error_msg}, internal error (TooManyRequestsException): {e}]')
+        return error(429, client_error_msg, {'Retry-After': retry_after_header(e.retry_after_secs)})
+    elif isinstance(e, DataAccessLayerException) and isinstance(e.original_exception, CircuitOpenException):
+        client_error_msg = f'{client_error_msg} - Database temporarily unavailable, please retry later'
+        logger.warning(f'[client error code: {client_err_code}, client error message: {client_error_msg}, internal error (CircuitOpenException): {e.original_exception}]')
+        return error(503, client_error_msg, {'Retry-After': retry_after_header(e.original_exception.retry_after_secs)})
     elif isinstance(e, DataAccessLayerException):
         client_error_msg = f'{client_error_msg} - Error while interacting with the database'
         logger.error(f'[client error code: {client_err_code}, client error message: {client_error_msg}, internal error (DataAccessLayerException): {e.original_exception}]')
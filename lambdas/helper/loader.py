@@ -0,0 +1,234 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import csv
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .circuitbreaker import is_unavailable_error
+from .dal import DataAccessLayerException, PackageSet
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Referenced tables first so FK constraints hold: each phase is a full streaming pass over the input.
+# EC2s are marked complete last, so the change feed only lists them once all their relations are loaded
+load_phases = ['package', 'ec2', 'ec2_package', 'ec2_complete']
+
+#-----------------------------------------------------------------------------------------------
+# Input Files
+#-----------------------------------------------------------------------------------------------
+def open_inventory_file(file_path):
+    return gzip.open(file_path, 'rt', newline='') if file_path.endswith('.gz') else open(file_path, 'r', newline='')
+
+def iter_inventory_records(file_path):
+    # NDJSON: one EC2 per line, same fields as the POST:/ec2/{aws_instance_id} body plus aws_instance_id
+    # CSV: one EC2-package relation per row (aws_instance_id,aws_region,aws_account,package_name,package_version)
+    is_csv = file_path.endswith('.csv') or file_path.endswith('.csv.gz')
+    with open_inventory_file(file_path) as inventory_file:
+        if is_csv:
+            for row in csv.DictReader(inventory_file):
+                packages = [{'package_name': row['package_name'], 'package_version': row['package_version']}] if row.get('package_name') else []
+                yield {
+                    'aws_instance_id': row['aws_instance_id'],
+                    'aws_region': row['aws_region'],
+                    'aws_account': row['aws_account'],
+                    'packages': packages
+                }
+        else:
+            for line in inventory_file:
+                if line.strip():
+                    yield json.loads(line)
+
+#-----------------------------------------------------------------------------------------------
+# Checkpoints
+#-----------------------------------------------------------------------------------------------
+class Checkpoint:
+    # Phase being loaded and number of input records of that phase already written to the database
+
+    def __init__(self, file_path=None):
+        self._file_path = file_path
+        self.phase_index = 0
+        self.records_done = 0
+        if file_path is not None and os.path.exists(file_path):
+            with open(file_path, 'r') as checkpoint_file:
+                state = json.load(checkpoint_file)
+            self.phase_index = state['phase_index']
+            self.records_done = state['records_done']
+
+    def save(self, phase_index, records_done):
+        self.phase_index = phase_index
+        self.records_done = records_done
+        if self._file_path is None:
+            return
+        tmp_file_path = f'{self._file_path}.tmp'
+        with open(tmp_file_path, 'w') as checkpoint_file:
+            json.dump({'phase_index': phase_index, 'phase': load_phases[phase_index] if phase_index < len(load_phases) else 'done', 'records_done': records_done}, checkpoint_file)
+        os.replace(tmp_file_path, self._file_path)
+
+#-----------------------------------------------------------------------------------------------
+# Batch Pipeline
+#-----------------------------------------------------------------------------------------------
+class BatchPipeline:
+    # Runs batch writes concurrently with a bounded number in flight, and tracks how many input
+    # records are fully acknowledged (all batches up to them written) for checkpointing
+
+    def __init__(self, write_batch, max_workers, max_in_flight, max_attempts=3):
+        self._write_batch = write_batch
+        self._max_attempts = max_attempts
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.Semaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._next_ack_seq = 0
+        self._acked = dict()
+        self._error = None
+        self.records_done = 0
+        self.rows_written = 0
+
+    def submit(self, rows, records_done):
+        # records_done: input records whose rows are all in this batch or in earlier ones
+        self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            raise self._error
+        seq = self._next_seq
+        self._next_seq += 1
+        future = self._executor.submit(self._run, rows)
+        future.add_done_callback(lambda f: self._done(f, seq, len(rows), records_done))
+
+    def _run(self, rows):
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                return self._write_batch(rows)
+            except DataAccessLayerException as de:
+                # retrying would fail again on, eg, a value too long for its column
+                if attempt == self._max_attempts or not is_unavailable_error(de.original_exception):
+                    raise de
+                logger.warning(f'Batch write failed (attempt {attempt}/{self._max_attempts}): {de.original_exception}')
+                time.sleep(2 ** attempt)
+
+    def _done(self, future, seq, num_rows, records_done):
+        with self._lock:
+            if future.exception() is not None:
+                self._error = self._error or future.exception()
+            else:
+                self._acked[seq] = (num_rows, records_done)
+                while self._next_ack_seq in self._acked:
+                    acked_rows, acked_records = self._acked.pop(self._next_ack_seq)
+                    self.rows_written += acked_rows
+                    self.records_done = acked_records
+                    self._next_ack_seq += 1
+        self._slots.release()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._error is not None:
+            raise self._error
+
+#-----------------------------------------------------------------------------------------------
+# Loader
+#-----------------------------------------------------------------------------------------------
+class BulkLoader:
+
+    def __init__(self, dal, batch_size=1000, max_workers=4, max_in_flight=8, checkpoint=None, progress_interval_secs=10):
+        self._dal = dal
+        self._batch_size = batch_size
+        self._max_workers = max_workers
+        self._max_in_flight = max_in_flight
+        self._checkpoint = checkpoint if checkpoint is not None else Checkpoint()
+        self._progress_interval_secs = progress_interval_secs
+
+    def _write_batch(self, phase, rows):
+        if phase == 'package':
+            return self._dal.save_packages_batch(rows, len(rows))
+        if phase == 'ec2':
+            return self._dal.save_ec2_batch(rows, len(rows))
+        if phase == 'ec2_complete':
+            return self._dal.complete_ec2_batch(rows, len(rows))
+        return self._dal.save_relations_batch(rows, len(rows), ignore_key_conflict=True)
+
+    @staticmethod
+    def _record_rows(phase, record, package_set, last_aws_instance_id):
+        if phase == 'package':
+            return [ package for package in record.get('packages', []) if package_set.add(package['package_name'], package['package_version']) ]
+        if phase in ['ec2', 'ec2_complete']:
+            # CSV inputs repeat the EC2 fields on each relation row
+            if record['aws_instance_id'] == last_aws_instance_id:
+                return []
+            if phase == 'ec2_complete':
+                return [record['aws_instance_id']]
+            return [{'aws_instance_id': record['aws_instance_id'], 'aws_region': record['aws_region'], 'aws_account': record['aws_account']}]
+        return [
+            {'aws_instance_id': record['aws_instance_id'], 'package_name': package['package_name'], 'package_version': package['package_version']}
+            for package in record.get('packages', [])
+        ]
+
+    def _report_progress(self, phase, pipeline, start_time):
+        elapsed = max(time.monotonic() - start_time, 1e-6)
+        logger.info(f'[{phase}] records: {pipeline.records_done}, rows written: {pipeline.rows_written}, throughput: {pipeline.rows_written/elapsed:.0f} rows/s')
+
+    def _load_phase(self, phase_index, file_path, skip_records):
+        # Rows of all phases are inserted with 'insert ignore' into tables with a primary key (and
+        # completion dates only set once), so replaying the batches written after the last checkpoint
+        # (or retrying a batch that timed out after committing) is harmless
+        phase = load_phases[phase_index]
+        pipeline = BatchPipeline(lambda rows: self._write_batch(phase, rows), self._max_workers, self._max_in_flight)
+        pipeline.records_done = skip_records
+        package_set = PackageSet()
+        rows = []
+        last_aws_instance_id = None
+        records_done = skip_records
+        start_time = last_report_time = time.monotonic()
+        try:
+            for record_index, record in enumerate(iter_inventory_records(file_path)):
+                if record_index < skip_records:
+                    continue
+                for row in BulkLoader._record_rows(phase, record, package_set, last_aws_instance_id):
+                    rows.append(row)
+                    if len(rows) == self._batch_size:
+                        pipeline.submit(rows, records_done)
+                        rows = []
+                last_aws_instance_id = record['aws_instance_id']
+                records_done = record_index + 1
+                if time.monotonic() - last_report_time >= self._progress_interval_secs:
+                    self._checkpoint.save(phase_index, pipeline.records_done)
+                    self._report_progress(phase, pipeline, start_time)
+                    last_report_time = time.monotonic()
+            if len(rows) > 0:
+                pipeline.submit(rows, records_done)
+        finally:
+            try:
+                pipeline.close()
+            finally:
+                self._checkpoint.save(phase_index, pipeline.records_done)
+        self._report_progress(phase, pipeline, start_time)
+        return pipeline.rows_written
+
+    def load(self, file_path):
+        rows_written = dict()
+        for phase_index, phase in enumerate(load_phases):
+            if phase_index < self._checkpoint.phase_index:
+                logger.info(f'[{phase}] already loaded according to checkpoint, skipping')
+                continue
+            skip_records = self._checkpoint.records_done if phase_index == self._checkpoint.phase_index else 0
+            rows_written[phase] = self._load_phase(phase_index, file_path, skip_records)
+            self._checkpoint.save(phase_index + 1, 0)
+        return rows_written
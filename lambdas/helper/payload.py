@@ -0,0 +1,120 @@
+"""
+  Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+  software and associated documentation files (the "Software"), to deal in the Software
+  without restriction, including without limitation the rights to use, copy, modify,
+  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+  permit persons to whom the Software is furnished to do so.
+
+  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import hashlib
+import json
+import re
+
+whitespace_regex = re.compile(r'[ \t\n\r]*')
+
+class Ec2Payload:
+    # POST:/ec2/{aws_instance_id} body parsed without materializing the packages array, whose size
+    # is only bounded by the API Gateway payload limit. The constructor makes a validating scan pass
+    # that keeps the other fields, the package count and hash, and the offset of the array, then
+    # iter_packages() decodes the packages again one at a time.
+
+    def __init__(self, body):
+        self._body = body
+        self._decoder = json.JSONDecoder()
+        self.fields = dict()
+        self.field_names = []
+        self.num_packages = 0
+        self._packages_offset = None
+        self._packages_sha256 = hashlib.sha256(b'[]')
+        try:
+            self._scan()
+        except IndexError:
+            raise ValueError('Invalid input - body is not a complete JSON object')
+
+    @property
+    def packages_sha256(self):
+        # sha256 of json.dumps(packages, sort_keys=True, separators=(',', ':')), packages being
+        # the saved package_name/package_version pairs in input order
+        return self._packages_sha256.hexdigest()
+
+    def _skip_whitespace(self, idx):
+        return whitespace_regex.match(self._body, idx).end()
+
+    def _expect(self, idx, char):
+        idx = self._skip_whitespace(idx)
+        if self._body[idx] != char:
+            raise ValueError(f'Invalid input - expected \'{char}\' at position {idx} of body')
+        return self._skip_whitespace(idx + 1)
+
+    def _scan(self):
+        idx = self._expect(0, '{')
+        while self._body[idx] != '}':
+            if self._body[idx] != '"':
+                raise ValueError(f'Invalid input - expected a field name at position {idx} of body')
+            field_name, idx = self._decoder.raw_decode(self._body, idx)
+            idx = self._expect(idx, ':')
+            self.field_names.append(field_name)
+            if field_name == 'packages':
+                idx = self._scan_packages(idx)
+            else:
+                self.fields[field_name], idx = self._decoder.raw_decode(self._body, idx)
+            idx = self._skip_whitespace(idx)
+            if self._body[idx] == ',':
+                idx = self._skip_whitespace(idx + 1)
+                if self._body[idx] == '}':
+                    raise ValueError(f'Invalid input - expected a field name at position {idx} of body')
+            elif self._body[idx] != '}':
+                raise ValueError(f'Invalid input - expected \',\' or \'}}\' at position {idx} of body')
+        if self._skip_whitespace(idx + 1) != len(self._body):
+            raise ValueError(f'Invalid input - unexpected data after position {idx} of body')
+
+    def _scan_packages(self, idx):
+        # like json.loads, the last occurrence of a duplicated field wins
+        self._packages_offset = idx
+        self.num_packages = 0
+        self._packages_sha256 = hashlib.sha256(b'[')
+        end_idx = None
+        for package, end_idx in self._iter_packages(idx):
+            if self.num_packages > 0:
+                self._packages_sha256.update(b',')
+            self._packages_sha256.update(json.dumps(package, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+            self.num_packages += 1
+        self._packages_sha256.update(b']')
+        if end_idx is None:
+            # empty array
+            end_idx = self._expect(self._expect(idx, '['), ']')
+        return end_idx
+
+    def _iter_packages(self, idx):
+        # yields (package, index right after the package's trailing ',' or the array's ']')
+        idx = self._expect(idx, '[')
+        if self._body[idx] == ']':
+            return
+        while True:
+            value, idx = self._decoder.raw_decode(self._body, idx)
+            if not isinstance(value, dict) \
+                    or not isinstance(value.get('package_name'), str) or not isinstance(value.get('package_version'), str):
+                raise ValueError(f'Invalid package: {value} (package_name and package_version are mandatory)')
+            idx = self._skip_whitespace(idx)
+            if self._body[idx] not in ',]':
+                raise ValueError(f'Invalid input - expected \',\' or \']\' at position {idx} of body')
+            end_of_array = self._body[idx] == ']'
+            idx = self._skip_whitespace(idx + 1)
+            yield {'package_name': value['package_name'], 'package_version': value['package_version']}, idx
+            if end_of_array:
+                return
+
+    def iter_packages(self):
+        if self._packages_offset is None:
+            return
+        for package, _ in self._iter_packages(self._packages_offset):
+            yield package
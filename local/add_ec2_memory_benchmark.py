@@ -0,0 +1,125 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+# Measures the peak memory (tracemalloc) of handling a POST:/ec2/{aws_instance_id} request with a
+# large package list, with the Data API stubbed out:
+#
+# * materialized: what add_ec2_info did before the streaming write path (json.loads of the body,
+#   full parameter set lists for packages and relations, debug string of all the parameter sets,
+#   input echoed back in the response)
+# * streaming: add_ec2_info.handler as it is now (Ec2Payload, chunked save_ec2, summary response)
+#
+# The request body itself is allocated before measuring, as it is part of the event in both cases.
+#
+# Usage (from the project's root directory):
+#   python local/add_ec2_memory_benchmark.py --packages 50000
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+lambdas_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas')
+sys.path.insert(0, lambdas_dir)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from helper.dal import DataAccessLayer
+import add_ec2_info
+
+database_name = 'ec2_inventory_db'
+db_cluster_arn = 'arn:aws:rds:us-east-1:123456789012:cluster:local-cluster'
+db_credentials_secrets_store_arn = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:local-secret'
+batch_size = 200
+
+class StubDataApi:
+    # Stand-in rds-data client returning responses shaped like the Data API ones
+    def execute_statement(self, **kwargs):
+        return {'numberOfRecordsUpdated': 1, 'generatedFields': []}
+
+    def batch_execute_statement(self, parameterSets, **kwargs):
+        return {'updateResults': [ {'generatedFields': []} for _ in parameterSets ]}
+
+def request_event(num_packages):
+    packages = [ {'package_name': f'package-{i % 5000}', 'package_version': f'1.{i}.0-{i % 17}'} for i in range(num_packages) ]
+    body = json.dumps({'aws_region': 'us-east-1', 'aws_account': '123456789012', 'packages': packages})
+    return {'pathParameters': {'aws_instance_id': 'i-01aaae43feb712345'}, 'body': body}
+
+def materialized_handler(event, data_api):
+    add_ec2_info.logger.info(f'Event received: {event}')
+    aws_instance_id = event['pathParameters']['aws_instance_id']
+    input_fields = json.loads(event['body'])
+    ec2_fields = input_fields.copy()
+    ec2_fields.pop('packages')
+    parameters = {'secretArn': db_credentials_secrets_store_arn, 'database': database_name, 'resourceArn': db_cluster_arn}
+    data_api.execute_statement(sql='insert into ec2', parameters=[], **parameters)
+    for table_name, sql_parameter_sets in [
+        ('package', [ [
+            {'name':'package_name', 'value':{'stringValue': package['package_name']}},
+            {'name':'package_version', 'value':{'stringValue': package['package_version']}}
+        ] for package in input_fields['packages'] ]),
+        ('ec2_package', [ [
+            {'name':'aws_instance_id', 'value':{'stringValue': aws_instance_id}},
+            {'name':'package_name', 'value':{'stringValue': package['package_name']}},
+            {'name':'package_version', 'value':{'stringValue': package['package_version']}}
+        ] for package in input_fields['packages'] ])
+    ]:
+        debug_parameters = f' with parameters: {sql_parameter_sets}'
+        results = []
+        for i in range(0, len(sql_parameter_sets), batch_size):
+            results.append(data_api.batch_execute_statement(sql=f'insert into {table_name}', parameterSets=sql_parameter_sets[i:i + batch_size], **parameters))
+    return add_ec2_info.success({'new_record': input_fields})
+
+def streaming_handler(event, data_api):
+    add_ec2_info.dal = DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn, rdsdata_client=data_api)
+    return add_ec2_info.handler(event, None)
+
+def measure(label, handler, event):
+    gc.collect()
+    tracemalloc.start()
+    ts = time.perf_counter()
+    # per-batch progress messages are not part of the measurement output
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = handler(event, StubDataApi())
+    elapsed_ms = (time.perf_counter() - ts) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert 200 == response['statusCode'], response
+    print(f'{label:<14} peak: {peak / 2**20:8.1f} MiB   response: {len(response["body"]) / 2**10:8.1f} KiB   time: {elapsed_ms:8.0f} ms')
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(description='add_ec2_info peak memory benchmark')
+    parser.add_argument('--packages', type=int, default=50000)
+    args = parser.parse_args()
+
+    event = request_event(args.packages)
+    print(f'Packages: {args.packages}, body: {len(event["body"]) / 2**20:.1f} MiB')
+    materialized_peak = measure('materialized', materialized_handler, event)
+    streaming_peak = measure('streaming', streaming_handler, event)
+    print(f'Peak memory reduction: {materialized_peak / streaming_peak:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+# Measures the per-call latency of DataAccessLayer.execute_statement depending on rds-data client
+# and connection reuse, against a local Data API stand-in:
+#
+# * new client per call: what DataAccessLayer did before clients were shared per container
+# * shared client, new connection per call: the stand-in closes every connection
+# * shared client, reused connection: keep-alive connections from the client's pool
+#
+# The stand-in sleeps --handshake-ms on each new connection to stand for the TCP + TLS handshake
+# with the regional Data API endpoint.
+#
+# Usage (from the project's root directory):
+#   python local/client_reuse_benchmark.py --calls 200 --handshake-ms 20
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+lambdas_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas')
+sys.path.insert(0, lambdas_dir)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from helper.dal import DataAccessLayer, get_rdsdata_client, rdsdata_client_config
+import boto3
+
+database_name = 'ec2_inventory_db'
+db_cluster_arn = 'arn:aws:rds:us-east-1:123456789012:cluster:local-cluster'
+db_credentials_secrets_store_arn = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:local-secret'
+
+class LocalDataApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    handshake_secs = 0.0
+    keep_alive = True
+
+    def setup(self):
+        # called once per connection
+        time.sleep(LocalDataApiHandler.handshake_secs)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'records': [[{'longValue': 1}]]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if not LocalDataApiHandler.keep_alive:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer needs Python 3.7
+    daemon_threads = True
+
+def start_local_data_api(handshake_ms):
+    LocalDataApiHandler.handshake_secs = handshake_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalDataApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def time_calls(num_calls, new_dal):
+    latencies_ms = []
+    for _ in range(num_calls):
+        ts = time.perf_counter()
+        new_dal().execute_statement('select 1')
+        latencies_ms.append((time.perf_counter() - ts) * 1000)
+    return latencies_ms
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f'{label:<42} median: {statistics.median(samples):8.2f} ms   p95: {p95:8.2f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='rds-data client and connection reuse benchmark')
+    parser.add_argument('--calls', type=int, default=100)
+    parser.add_argument('--handshake-ms', type=float, default=20.0, help='simulated handshake cost per new connection')
+    args = parser.parse_args()
+
+    server, endpoint_url = start_local_data_api(args.handshake_ms)
+    try:
+        def new_client_per_call():
+            client = boto3.client('rds-data', endpoint_url=endpoint_url, config=rdsdata_client_config())
+            return DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn, rdsdata_client=client)
+
+        def shared_client():
+            return DataAccessLayer(database_name, db_cluster_arn, db_credentials_secrets_store_arn, rdsdata_client=get_rdsdata_client(endpoint_url))
+
+        print(f'Calls: {args.calls}, simulated handshake: {args.handshake_ms} ms')
+        LocalDataApiHandler.keep_alive = True
+        summarize('new client per call', time_calls(args.calls, new_client_per_call))
+        LocalDataApiHandler.keep_alive = False
+        summarize('shared client, new connection per call', time_calls(args.calls, shared_client))
+        LocalDataApiHandler.keep_alive = True
+        shared_client().execute_statement('select 1')
+        summarize('shared client, reused connection', time_calls(args.calls, shared_client))
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
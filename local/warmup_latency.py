@@ -0,0 +1,140 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+# Measures cold- vs warm-path latency of the GetEC2Info handler with the Data API stubbed out.
+#
+# A cold path pays for the handler module initialization (imports, boto3 client creation) plus
+# the first database round trip, which is delayed by --resume-delay-ms to simulate Aurora
+# Serverless resuming from auto-pause. Each cold sample runs in a new Python process, so nothing
+# (modules, boto3 sessions, botocore's loaded service models) is cached from earlier samples. A
+# warm path runs after a keep-warm ping has already initialized the container and resumed the
+# database.
+#
+# Usage (from the project's root directory):
+#   python local/warmup_latency.py --iterations 20 --resume-delay-ms 500
+
+import argparse
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+lambdas_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas')
+sys.path.insert(0, lambdas_dir)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('DB_NAME', 'ec2_inventory_db')
+os.environ.setdefault('DB_CLUSTER_ARN', 'arn:aws:rds:us-east-1:123456789012:cluster:local-cluster')
+os.environ.setdefault('DB_CRED_SECRETS_STORE_ARN', 'arn:aws:secretsmanager:us-east-1:123456789012:secret:local-secret')
+
+handler_module_name = 'get_ec2_info'
+
+get_event = {
+    'httpMethod': 'GET',
+    'pathParameters': {'aws_instance_id': 'i-0000000001'}
+}
+
+warmup_event = {'warmup': True}
+
+class AuroraResumeSimulator:
+    # Sleeps on the first Data API call only, the way a paused Aurora Serverless cluster would
+    def __init__(self, resume_delay_ms):
+        self._resume_delay_ms = resume_delay_ms
+        self._paused = True
+
+    def __call__(self, **kwargs):
+        if self._paused:
+            time.sleep(self._resume_delay_ms / 1000)
+            self._paused = False
+
+def stub_data_api(module, resume_delay_ms, num_db_calls):
+    # imported here so a cold sample's import of botocore is timed with the handler module's
+    from botocore.stub import Stubber
+    client = module.dal._rdsdata_client
+    resume_simulator = AuroraResumeSimulator(resume_delay_ms)
+    client.meta.events.register('before-parameter-build.rds-data.ExecuteStatement', resume_simulator)
+    stubber = Stubber(client)
+    for _ in range(num_db_calls):
+        stubber.add_response('execute_statement', {'records': []})
+    stubber.activate()
+    return resume_simulator, stubber
+
+def unstub_data_api(module, resume_simulator, stubber):
+    stubber.deactivate()
+    module.dal._rdsdata_client.meta.events.unregister('before-parameter-build.rds-data.ExecuteStatement', resume_simulator)
+
+def timed(f, *args):
+    ts = time.perf_counter()
+    response = f(*args)
+    te = time.perf_counter()
+    assert response['statusCode'] == 200, response
+    return (te - ts) * 1000
+
+def cold_sample(resume_delay_ms):
+    # run in a new process by measure_cold
+    ts = time.perf_counter()
+    module = importlib.import_module(handler_module_name)
+    stub_data_api(module, resume_delay_ms, num_db_calls=1)
+    init_ms = (time.perf_counter() - ts) * 1000
+    return init_ms + timed(module.handler, get_event, None)
+
+def measure_cold(resume_delay_ms):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--cold-sample', '--resume-delay-ms', str(resume_delay_ms)],
+        stdout=subprocess.PIPE, check=True, universal_newlines=True
+    ).stdout
+    return float(output.split()[-1])
+
+def measure_warm(resume_delay_ms):
+    module = importlib.import_module(handler_module_name)
+    resume_simulator, stubber = stub_data_api(module, resume_delay_ms, num_db_calls=2)
+    try:
+        timed(module.handler, warmup_event, None)
+        return timed(module.handler, get_event, None)
+    finally:
+        unstub_data_api(module, resume_simulator, stubber)
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f'{label:<28} median: {statistics.median(samples):8.2f} ms   p95: {p95:8.2f} ms   max: {samples[-1]:8.2f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold vs warm handler latency with a stubbed Data API')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--resume-delay-ms', type=float, default=0.0,
+                        help='simulated Aurora Serverless resume delay on the first database call')
+    parser.add_argument('--cold-sample', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_sample:
+        print(cold_sample(args.resume_delay_ms))
+        return
+
+    cold = [measure_cold(args.resume_delay_ms) for _ in range(args.iterations)]
+    warm = [measure_warm(args.resume_delay_ms) for _ in range(args.iterations)]
+    print(f'Handler: {handler_module_name}, iterations: {args.iterations}, simulated resume delay: {args.resume_delay_ms} ms')
+    summarize('cold (init + 1st request)', cold)
+    summarize('warm (after keep-warm ping)', warm)
+
+if __name__ == '__main__':
+    main()
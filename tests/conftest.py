@@ -0,0 +1,82 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+# Makes the Lambda and deployment script modules importable from the (non-integration) tests, and
+# holds the stand-ins they share
+
+import os
+import sys
+import pytest
+
+project_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(project_dir, 'lambdas'))
+sys.path.insert(0, os.path.join(project_dir, 'deploy_scripts', 'ddl_scripts'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+cluster_arn = 'arn:aws:rds:us-east-1:123456789012:cluster:test-cluster'
+secret_arn = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:test-secret'
+
+class RecordingDataApi:
+    # Stand-in rds-data client. Records each statement with its parameter values, each call in order
+    # ('begin', 'insert (tx-1)', 'batch ec2_package', 'commit', ...) and the number of parameter sets
+    # of each batch per table. Statements return the next of responses if given, else records;
+    # statements and batches starting with fail_on raise error
+    def __init__(self, records=[], responses=None, fail_on=None, error=None):
+        self.records = records
+        self.responses = responses
+        self.fail_on = fail_on
+        self.error = error if error is not None else Exception('database unavailable')
+        self.statements = []
+        self.calls = []
+        self.batches = []
+
+    def begin_transaction(self, **kwargs):
+        self.calls.append('begin')
+        return {'transactionId': 'tx-1'}
+
+    def execute_statement(self, sql, parameters=[], transactionId=None, **kwargs):
+        self.statements.append((sql, { p['name']: next(iter(p['value'].values())) for p in parameters }))
+        self.calls.append(sql.split()[0] if transactionId is None else f'{sql.split()[0]} ({transactionId})')
+        if self.fail_on is not None and sql.startswith(self.fail_on):
+            raise self.error
+        return {'records': self.responses[len(self.statements) - 1] if self.responses is not None else self.records}
+
+    def batch_execute_statement(self, sql, parameterSets, transactionId=None, **kwargs):
+        table_name = sql.split(' into ')[1].split()[0]
+        self.batches.append((table_name, len(parameterSets)))
+        self.calls.append(f'batch {table_name}' if transactionId is None else f'batch {table_name} ({transactionId})')
+        if self.fail_on is not None and sql.startswith(self.fail_on):
+            raise self.error
+        return {'updateResults': []}
+
+    def commit_transaction(self, transactionId, **kwargs):
+        self.calls.append('commit')
+
+    def rollback_transaction(self, transactionId, **kwargs):
+        self.calls.append('rollback')
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
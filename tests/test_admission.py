@@ -0,0 +1,104 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+
+import json
+import pytest
+from helper.admission import AdmissionController, AuroraTokenBucketStore, InMemoryTokenBucketStore, TooManyRequestsException
+from helper.dal import DataAccessLayer
+from helper.lambdautils import handle_error
+from conftest import cluster_arn, secret_arn, RecordingDataApi
+
+def token_bucket_level(tokens):
+    return [[{'doubleValue': tokens}]]
+
+def aurora_admission_controller(data_api, clock):
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    return AdmissionController(AuroraTokenBucketStore(dal, sync_interval_secs=1), rate_per_sec=2, capacity=10, clock=clock)
+
+@pytest.fixture()
+def admission_controller(clock):
+    return AdmissionController(InMemoryTokenBucketStore(), rate_per_sec=1, capacity=10, package_cost=0.01, clock=clock)
+
+def test_admits_burst_then_rejects(admission_controller):
+    for _ in range(10):
+        admission_controller.admit('123456789012')
+    with pytest.raises(TooManyRequestsException) as e:
+        admission_controller.admit('123456789012')
+    assert 1.0 == pytest.approx(e.value.retry_after_secs)
+
+def test_tenants_have_independent_buckets(admission_controller):
+    admission_controller.admit('123456789012', num_packages=900)
+    with pytest.raises(TooManyRequestsException):
+        admission_controller.admit('123456789012', num_packages=100)
+    admission_controller.admit('210987654321', num_packages=100)
+
+def test_cost_is_weighted_by_package_count_and_refills(admission_controller, clock):
+    # 1 + 50000 * 0.01 is capped to the bucket capacity so it can eventually be admitted
+    assert 10 == admission_controller.cost(50000)
+    admission_controller.admit('123456789012', num_packages=50000)
+    with pytest.raises(TooManyRequestsException) as e:
+        admission_controller.admit('123456789012', num_packages=400)
+    assert 5.0 == pytest.approx(e.value.retry_after_secs)
+    clock.now += 5
+    admission_controller.admit('123456789012', num_packages=400)
+
+def test_rejections_are_429_with_retry_after():
+    response = handle_error(TooManyRequestsException('123456789012', 2.2))
+    assert 429 == response['statusCode']
+    assert '3' == response['headers']['Retry-After']
+    assert 'Too many requests' in json.loads(response['body'])['error_message']
+
+def test_shared_bucket_is_synced_once_per_interval(clock):
+    data_api = RecordingDataApi(token_bucket_level(10.0))
+    admission_controller = aurora_admission_controller(data_api, clock)
+    for _ in range(3):
+        admission_controller.admit('123456789012')
+    # the first request syncs, the others are admitted from the container's bucket
+    assert ['insert', 'select'] == data_api.calls
+    assert 0 == data_api.statements[0][1]['cost']
+    clock.now += 1
+    admission_controller.admit('123456789012')
+    # tokens taken since the previous sync are debited from the shared bucket
+    assert ['insert', 'select'] * 2 == data_api.calls
+    assert 3 == data_api.statements[2][1]['cost']
+
+def test_shared_bucket_level_limits_admission(clock):
+    data_api = RecordingDataApi(token_bucket_level(0.5))
+    with pytest.raises(TooManyRequestsException) as e:
+        aurora_admission_controller(data_api, clock).admit('123456789012', num_packages=100)
+    # (2 - 0.5) tokens at 2 tokens per second
+    assert 0.75 == pytest.approx(e.value.retry_after_secs)
+    # over-admissions of other containers are paid back
+    data_api = RecordingDataApi(token_bucket_level(-4.0))
+    with pytest.raises(TooManyRequestsException) as e:
+        aurora_admission_controller(data_api, clock).admit('123456789012')
+    assert 2.5 == pytest.approx(e.value.retry_after_secs)
+
+def test_failed_sync_admits_from_local_bucket(clock):
+    data_api = RecordingDataApi(token_bucket_level(10.0), fail_on='insert')
+    admission_controller = aurora_admission_controller(data_api, clock)
+    for _ in range(10):
+        admission_controller.admit('123456789012')
+    with pytest.raises(TooManyRequestsException):
+        admission_controller.admit('123456789012')
+    # not retried before the next interval
+    assert ['insert'] == data_api.calls
+    clock.now += 1
+    data_api.fail_on = None
+    admission_controller.admit('123456789012')
+    assert 10 == data_api.statements[-2][1]['cost']
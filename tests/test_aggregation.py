@@ -0,0 +1,60 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import pytest
+import helper.dal
+from helper.dal import DataAccessLayer, DataAccessLayerException
+from conftest import cluster_arn, secret_arn, RecordingDataApi
+
+def test_count_hosts_by_package_version_from_base_tables(monkeypatch):
+    monkeypatch.setattr(helper.dal, 'package_version_summary_enabled', False)
+    data_api = RecordingDataApi([[{'stringValue': 'v1'}, {'stringValue': 'us-east-1'}, {'longValue': 3}]])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    results = dal.count_hosts_by_package_version('package-1', ['aws_region'], aws_account='123456789012')
+    assert [{'package_version': 'v1', 'aws_region': 'us-east-1', 'host_count': 3}] == results
+    sql, values = data_api.statements[0]
+    assert 'count(distinct e.aws_instance_id)' in sql
+    assert 'group by ep.package_version, e.aws_region' in sql
+    assert {'package-1', '123456789012'} == set(values.values())
+
+def test_count_hosts_by_package_version_from_summary(monkeypatch):
+    monkeypatch.setattr(helper.dal, 'package_version_summary_enabled', True)
+    data_api = RecordingDataApi()
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    dal.count_hosts_by_package_version('package-1')
+    assert 'sum(s.host_count)' in data_api.statements[-1][0]
+    # creation dates are only available on the ec2 table
+    dal.count_hosts_by_package_version('package-1', created_after='2019-01-01 00:00:00')
+    assert 'count(distinct e.aws_instance_id)' in data_api.statements[-1][0]
+
+def test_count_hosts_by_package_version_rejects_unknown_columns():
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=RecordingDataApi())
+    with pytest.raises(ValueError):
+        dal.count_hosts_by_package_version('package-1', ['package_name; drop table ec2'])
+
+def test_rebuild_package_version_summary_in_one_transaction():
+    data_api = RecordingDataApi()
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    dal.rebuild_package_version_summary()
+    assert ['begin', 'delete (tx-1)', 'insert (tx-1)', 'commit'] == data_api.calls
+
+def test_rebuild_package_version_summary_rolls_back_on_error():
+    data_api = RecordingDataApi(fail_on='insert')
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    with pytest.raises(DataAccessLayerException):
+        dal.rebuild_package_version_summary()
+    assert ['begin', 'delete (tx-1)', 'insert (tx-1)', 'rollback'] == data_api.calls
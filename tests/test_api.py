@@ -15,7 +15,10 @@
  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 '''
 
+import hashlib
+import json
 import os
+import time
 import requests
 import boto3
 import pytest
@@ -33,6 +36,15 @@ def api_endpoint():
     stack = cloudformation.Stack(api_stack_name)
     return get_cfn_output('ApiEndpoint', stack.outputs)
 
+@pytest.fixture(scope="module", autouse=True)
+def warm_up_aurora(api_endpoint):
+    # The first request after auto-pause resumes Aurora Serverless and may fail while it does so
+    for _ in range(10):
+        r = requests.get(f'{api_endpoint}/ec2/{uuid.uuid4()}')
+        if r.status_code == HTTPStatus.OK:
+            return
+        time.sleep(10)
+
 @pytest.fixture()
 def ec2_input_data():
     return {
@@ -49,7 +61,6 @@ def ec2_input_data():
     }
 
 # TODO: add_ec2* tests have side effects (create DB record for test but does not delete it)
-# TODO: Warm up Aurora Serverless with an initial request + sleep
 
 def test_add_ec2_info_returns_expected_attributes(api_endpoint, ec2_input_data):
     r = requests.post(f'{api_endpoint}/ec2/{ec2_input_data["instance_id"]}', json = ec2_input_data['input_data'])
@@ -58,7 +69,10 @@ def test_add_ec2_info_returns_expected_attributes(api_endpoint, ec2_input_data):
     assert 'new_record' in response
     assert ec2_input_data['input_data']['aws_region'] == response['new_record']['aws_region']
     assert ec2_input_data['input_data']['aws_account'] == response['new_record']['aws_account']
-    assert ec2_input_data['input_data']['packages'] == response['new_record']['packages']
+    packages = ec2_input_data['input_data']['packages']
+    assert len(packages) == response['new_record']['num_packages']
+    packages_sha256 = hashlib.sha256(json.dumps(packages, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+    assert packages_sha256 == response['new_record']['packages_sha256']
 
 def test_add_ec2_info_error_duplicate(api_endpoint, ec2_input_data):
     r = requests.post(f'{api_endpoint}/ec2/{ec2_input_data["instance_id"]}', json = ec2_input_data['input_data'])
@@ -87,3 +101,35 @@ def test_get_ec2_info_record_not_found(api_endpoint):
     assert r.status_code ==  HTTPStatus.OK
     response = r.json()
     assert False == response['record_found']
+
+def test_get_package_versions_counts_new_ec2(api_endpoint, ec2_input_data):
+    r = requests.post(f'{api_endpoint}/ec2/{ec2_input_data["instance_id"]}', json = ec2_input_data['input_data'])
+    assert  HTTPStatus.OK == r.status_code
+
+    r = requests.get(f'{api_endpoint}/packages/package-1/versions', params = {'group_by': 'aws_region'})
+    assert r.status_code ==  HTTPStatus.OK
+    response = r.json()
+    assert ['aws_region'] == response['group_by']
+    versions = { (v['package_version'], v['aws_region']): v['host_count'] for v in response['versions'] }
+    assert versions[('v1', 'us-east-1')] >= 1
+    assert versions[('v2', 'us-east-1')] >= 1
+
+def test_get_package_versions_invalid_group_by(api_endpoint):
+    r = requests.get(f'{api_endpoint}/packages/package-1/versions', params = {'group_by': 'package_name'})
+    assert  HTTPStatus. BAD_REQUEST == r.status_code
+
+def test_get_ec2_changes_pages_with_next_token(api_endpoint):
+    r = requests.get(f'{api_endpoint}/ec2', params = {'since': '2019-01-01 00:00:00', 'limit': 2})
+    assert r.status_code ==  HTTPStatus.OK
+    response = r.json()
+    assert len(response['records']) <= 2
+    assert 'next_token' in response
+
+    r = requests.get(f'{api_endpoint}/ec2', params = {'next_token': response['next_token'], 'limit': 2})
+    assert r.status_code ==  HTTPStatus.OK
+    next_ids = { record['aws_instance_id'] for record in r.json()['records'] }
+    assert next_ids.isdisjoint(record['aws_instance_id'] for record in response['records'])
+
+def test_get_ec2_changes_invalid_since(api_endpoint):
+    r = requests.get(f'{api_endpoint}/ec2', params = {'since': 'yesterday'})
+    assert  HTTPStatus. BAD_REQUEST == r.status_code
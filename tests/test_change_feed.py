@@ -0,0 +1,108 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import pytest
+from helper.dal import DataAccessLayer
+from helper.lambdautils import encode_continuation_token, decode_continuation_token
+from conftest import cluster_arn, secret_arn, RecordingDataApi
+
+def ec2_record(aws_instance_id, completion_date_utc):
+    return [{'stringValue': aws_instance_id}, {'stringValue': 'us-east-1'}, {'stringValue': '123456789012'},
+            {'stringValue': '2019-03-06 02:45:00'}, {'stringValue': completion_date_utc}]
+
+def package_records(*package_names):
+    return [ [{'stringValue': package_name}, {'stringValue': 'v1'}] for package_name in package_names ]
+
+def page_summary(records):
+    return [ (record['aws_instance_id'], len(record['packages']), record['more_packages']) for record in records ]
+
+def test_find_ec2s_completed_since_resumes_after_key():
+    data_api = RecordingDataApi(responses=[
+        [ec2_record('i-2', '2019-03-06 02:45:32'), ec2_record('i-3', '2019-03-06 02:45:33')],
+        package_records('package-1'),
+        package_records('package-1', 'package-2')
+    ])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    records, has_more = dal.find_ec2s_completed_since('2019-03-06 00:00:00', ['2019-03-06 02:45:32', 'i-1'], limit=2)
+    assert ['i-2', 'i-3'] == [ record['aws_instance_id'] for record in records ]
+    assert ['package-1', 'package-2'] == [ package['package_name'] for package in records[1]['packages'] ]
+    assert has_more
+    sql, values = data_api.statements[0]
+    assert 'order by completion_date_utc, aws_instance_id limit 2' in sql
+    assert 'completion_date_utc>=:since' in sql
+    assert 'aws_instance_id>:after_id' in sql
+    assert {'since': '2019-03-06 00:00:00', 'after_date': '2019-03-06 02:45:32', 'after_id': 'i-1'} == values
+    # packages are read EC2 by EC2 from the primary key, bounded by what is left of the page
+    assert 3 == len(data_api.statements)
+    assert [{'aws_instance_id': 'i-2'}, {'aws_instance_id': 'i-3'}] == [ values for _, values in data_api.statements[1:] ]
+    assert data_api.statements[1][0].endswith('where aws_instance_id=:aws_instance_id order by package_name, package_version limit 1001')
+    assert data_api.statements[2][0].endswith('limit 1000')
+
+def test_find_ec2s_completed_since_no_new_ec2s():
+    data_api = RecordingDataApi(responses=[[]])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    assert ([], False) == dal.find_ec2s_completed_since('2019-03-06 00:00:00')
+    assert 1 == len(data_api.statements)
+
+def test_find_ec2s_completed_since_ends_page_at_max_packages():
+    ec2s = [ec2_record('i-1', '2019-03-06 02:45:31'), ec2_record('i-2', '2019-03-06 02:45:32'), ec2_record('i-3', '2019-03-06 02:45:33')]
+    # each packages query returns at most one row more than is left of the page
+    data_api = RecordingDataApi(responses=[
+        ec2s, package_records('package-1'), package_records('package-1', 'package-2', 'package-3'),
+        ec2s, package_records('package-1', 'package-2'), package_records('package-1')
+    ])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    # i-2 does not fit: it continues on the next page, and i-3 packages are not read
+    records, has_more = dal.find_ec2s_completed_since('2019-03-06 00:00:00', limit=10, max_packages=3)
+    assert [('i-1', 1, False), ('i-2', 2, True)] == page_summary(records)
+    assert has_more
+    assert ['limit 4', 'limit 3'] == [ sql[sql.index('limit'):] for sql, _ in data_api.statements[1:] ]
+    # i-2 fits exactly: the page ends with it and i-3 is left for the next page
+    records, has_more = dal.find_ec2s_completed_since('2019-03-06 00:00:00', limit=10, max_packages=3)
+    assert [('i-1', 2, False), ('i-2', 1, False)] == page_summary(records)
+    assert has_more
+    assert 6 == len(data_api.statements)
+
+def test_find_ec2s_completed_since_continues_packages_after_package():
+    data_api = RecordingDataApi(responses=[
+        [ec2_record('i-2', '2019-03-06 02:45:32'), ec2_record('i-3', '2019-03-06 02:45:33')],
+        package_records('package-3'),
+        package_records('package-1')
+    ])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    records, has_more = dal.find_ec2s_completed_since('2019-03-06 00:00:00', ['2019-03-06 02:45:32', 'i-2'], limit=10,
+                                                    after_package=['package-2', 'v1'], max_packages=3)
+    assert [('i-2', 1, False), ('i-3', 1, False)] == page_summary(records)
+    assert not has_more
+    # i-2 is listed again, with only its packages after package-2 v1
+    assert 'aws_instance_id>=:after_id' in data_api.statements[0][0]
+    sql, values = data_api.statements[1]
+    assert 'and (package_name>:after_name or (package_name=:after_name and package_version>:after_version))' in sql
+    assert {'aws_instance_id': 'i-2', 'after_name': 'package-2', 'after_version': 'v1'} == values
+    assert {'aws_instance_id': 'i-3'} == data_api.statements[2][1]
+
+def test_continuation_token_round_trip():
+    state = {'since': '2019-03-06 00:00:00', 'after': ['2019-03-06 02:45:32', 'i-01aaae43feb712345']}
+    token = encode_continuation_token(state)
+    assert '=' not in token and '+' not in token and '/' not in token
+    assert state == decode_continuation_token(token)
+
+def test_invalid_continuation_token():
+    with pytest.raises(ValueError):
+        decode_continuation_token('not a token')
+    with pytest.raises(ValueError):
+        decode_continuation_token(encode_continuation_token(['not', 'a', 'dict']))
@@ -0,0 +1,106 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+
+import pytest
+from botocore.exceptions import ClientError, ReadTimeoutError
+from helper.circuitbreaker import CircuitBreaker, CircuitOpenException, CLOSED, OPEN, HALF_OPEN
+from helper.dal import DataAccessLayer, DataAccessLayerException
+from helper.lambdautils import handle_error
+from conftest import cluster_arn, secret_arn
+
+def client_error(code, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, 'ExecuteStatement')
+
+class UnavailableDataApi:
+    def __init__(self):
+        self.num_calls = 0
+        self.available = False
+
+    def execute_statement(self, **kwargs):
+        self.num_calls += 1
+        if not self.available:
+            raise client_error('BadRequestException', 'Communications link failure')
+        return {'records': []}
+
+@pytest.fixture()
+def circuit_breaker(clock):
+    return CircuitBreaker(min_calls=4, failure_rate_threshold=0.5, consecutive_failures=0, open_secs=30, clock=clock)
+
+def test_opens_on_failure_rate_and_ignores_client_errors(circuit_breaker):
+    for _ in range(4):
+        circuit_breaker.record_call(10, client_error('BadRequestException', "Duplicate entry 'i-1' for key 'PRIMARY'"))
+    assert CLOSED == circuit_breaker.state
+    for _ in range(4):
+        circuit_breaker.record_call(10, client_error('ServiceUnavailableError'))
+    assert OPEN == circuit_breaker.state
+
+def test_opens_on_slow_calls(clock):
+    circuit_breaker = CircuitBreaker(min_calls=4, slow_call_ms=1000, slow_call_rate_threshold=0.5, clock=clock)
+    for _ in range(4):
+        circuit_breaker.record_call(2000)
+    assert OPEN == circuit_breaker.state
+
+def test_opens_on_consecutive_timeouts_before_min_calls(clock):
+    # One call at a time, each timing out after the 30s read timeout: the 30s window never holds min_calls
+    circuit_breaker = CircuitBreaker(window_secs=30, min_calls=10, consecutive_failures=3, clock=clock)
+    for _ in range(2):
+        circuit_breaker.before_call()
+        clock.now += 30
+        circuit_breaker.record_call(30000, ReadTimeoutError(endpoint_url='https://rds-data.us-east-1.amazonaws.com'))
+    circuit_breaker.record_call(10)
+    assert CLOSED == circuit_breaker.state
+    for _ in range(3):
+        circuit_breaker.before_call()
+        clock.now += 30
+        circuit_breaker.record_call(30000, ReadTimeoutError(endpoint_url='https://rds-data.us-east-1.amazonaws.com'))
+    assert OPEN == circuit_breaker.state
+    with pytest.raises(CircuitOpenException):
+        circuit_breaker.before_call()
+
+def test_half_open_trial_closes_or_reopens(circuit_breaker, clock):
+    for _ in range(4):
+        circuit_breaker.record_call(10, client_error('ServiceUnavailableError'))
+    with pytest.raises(CircuitOpenException):
+        circuit_breaker.before_call()
+    clock.now += 30
+    assert HALF_OPEN == circuit_breaker.state
+    circuit_breaker.before_call()
+    with pytest.raises(CircuitOpenException):
+        circuit_breaker.before_call()
+    circuit_breaker.record_call(10, client_error('ServiceUnavailableError'))
+    assert OPEN == circuit_breaker.state
+    clock.now += 30
+    circuit_breaker.before_call()
+    circuit_breaker.record_call(10)
+    assert CLOSED == circuit_breaker.state
+
+def test_dal_fails_fast_with_503_while_open(circuit_breaker, clock):
+    data_api = UnavailableDataApi()
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, circuit_breaker=circuit_breaker, rdsdata_client=data_api)
+    for _ in range(4):
+        with pytest.raises(DataAccessLayerException):
+            dal.find_ec2('i-1')
+    with pytest.raises(DataAccessLayerException) as e:
+        dal.find_ec2('i-1')
+    response = handle_error(e.value)
+    assert 4 == data_api.num_calls
+    assert 503 == response['statusCode']
+    assert '30' == response['headers']['Retry-After']
+    data_api.available = True
+    clock.now += 30
+    assert {} == dal.find_ec2('i-1')
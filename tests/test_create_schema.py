@@ -0,0 +1,161 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import os
+import threading
+import pytest
+from botocore.exceptions import ClientError
+import create_schema
+
+ddl_scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deploy_scripts', 'ddl_scripts')
+
+class LocalDataApi:
+    # Minimal in-memory stand-in for the rds-data execute_statement API
+    def __init__(self, resume_errors=0, existing_tables=(), fail_on=None):
+        self.checksums = dict()
+        self.created_tables = []
+        self.existing_tables = set(existing_tables)
+        self.statements = []
+        self.resume_errors = resume_errors
+        self.fail_on = fail_on
+        self.continued_after_timeout = []
+        self._lock = threading.Lock()
+
+    def execute_statement(self, sql, parameters=[], **kwargs):
+        with self._lock:
+            if self.resume_errors > 0:
+                self.resume_errors -= 1
+                raise ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Communications link failure'}}, 'ExecuteStatement')
+            if self.fail_on is not None and sql.startswith(self.fail_on):
+                raise ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Lock wait timeout exceeded'}}, 'ExecuteStatement')
+            values = { p['name']: p['value']['stringValue'] for p in parameters }
+            self.statements.append(sql)
+            if kwargs.get('continueAfterTimeout'):
+                self.continued_after_timeout.append(sql)
+            if sql.startswith('select object_name, checksum'):
+                return {'records': [ [{'stringValue': k}, {'stringValue': v}] for k, v in self.checksums.items() ]}
+            if sql.startswith('select count(*) from information_schema.tables'):
+                return {'records': [[{'longValue': int(values['table_name'] in self.existing_tables)}]]}
+            if sql.startswith('insert into schema_checksum'):
+                self.checksums[values['object_name']] = values['checksum']
+            match = create_schema.create_table_regex.search(sql)
+            if match and match.group(1) != create_schema.schema_checksum_table_name and match.group(1) not in self.existing_tables:
+                self.existing_tables.add(match.group(1))
+                self.created_tables.append(match.group(1))
+            return {'records': []}
+
+@pytest.fixture()
+def tables():
+    return create_schema.load_ddl_scripts(create_schema.table_ddl_script_files, ddl_scripts_dir)
+
+def deploy(data_api, tables):
+    deployer = create_schema.SchemaDeployer(data_api, 'ec2_inventory_db', 'cluster-arn', 'secret-arn')
+    return deployer.deploy(tables)
+
+def test_load_ddl_scripts_builds_fk_dependency_graph(tables):
+    assert set() == tables['ec2']['depends_on']
+    assert set() == tables['package']['depends_on']
+    assert {'ec2', 'package'} == tables['ec2_package']['depends_on']
+    assert {'package'} == tables['package_version_summary']['depends_on']
+    assert set() == tables['token_bucket']['depends_on']
+
+def test_deploy_creates_referenced_tables_first(tables):
+    data_api = LocalDataApi()
+    assert {'ec2', 'package', 'ec2_package', 'package_version_summary', 'token_bucket'} == set(deploy(data_api, tables))
+    created_tables = data_api.created_tables
+    assert created_tables.index('ec2_package') > max(created_tables.index('ec2'), created_tables.index('package'))
+    assert created_tables.index('package_version_summary') > created_tables.index('package')
+
+def test_deploy_skips_unchanged_tables(tables):
+    data_api = LocalDataApi()
+    deploy(data_api, tables)
+    assert [] == deploy(data_api, tables)
+    assert 5 == len(data_api.created_tables)
+
+def test_deploy_retries_while_database_resumes(tables, monkeypatch):
+    monkeypatch.setattr(create_schema, 'retry_base_delay_secs', 0)
+    data_api = LocalDataApi(resume_errors=2)
+    assert 5 == len(deploy(data_api, tables))
+
+@pytest.fixture()
+def changed_ddl_scripts_dir(tmp_path):
+    # table_ec2.txt with one more column, plus the migration adding it to existing tables
+    with open(os.path.join(ddl_scripts_dir, 'table_ec2.txt'), 'r') as ddl_script:
+        ddl = ddl_script.read()
+    (tmp_path / 'table_ec2.txt').write_text(ddl.replace('PRIMARY KEY', 'instance_type VARCHAR(30),\n    PRIMARY KEY'))
+    (tmp_path / 'migration_ec2_instance_type.txt').write_text('ALTER TABLE ec2\n  ADD COLUMN instance_type VARCHAR(30);\n'
+        'UPDATE ec2 SET instance_type=\'unknown\';\n')
+    return tmp_path
+
+def test_deploy_fails_when_ddl_changed_without_migration(tables, changed_ddl_scripts_dir):
+    data_api = LocalDataApi()
+    deploy(data_api, tables)
+    applied_checksum = data_api.checksums['ec2']
+    changed_tables = create_schema.load_ddl_scripts(['table_ec2.txt'], changed_ddl_scripts_dir, {})
+    with pytest.raises(ValueError):
+        deploy(data_api, changed_tables)
+    # not recorded as applied, so the next run fails again until a migration is added
+    assert applied_checksum == data_api.checksums['ec2']
+
+def test_deploy_applies_pending_migrations(tables, changed_ddl_scripts_dir):
+    data_api = LocalDataApi()
+    deploy(data_api, tables)
+    migration_files = {'ec2': ['migration_ec2_instance_type.txt']}
+    changed_tables = create_schema.load_ddl_scripts(['table_ec2.txt'], changed_ddl_scripts_dir, migration_files)
+    assert ['ec2'] == deploy(data_api, changed_tables)
+    assert 'ALTER TABLE ec2\n  ADD COLUMN instance_type VARCHAR(30)' in data_api.statements
+    assert changed_tables['ec2']['checksum'] == data_api.checksums['ec2']
+    assert [] == deploy(data_api, changed_tables)
+
+def test_deploy_migrates_tables_created_before_checksums(changed_ddl_scripts_dir):
+    data_api = LocalDataApi(existing_tables=['ec2'])
+    migration_files = {'ec2': ['migration_ec2_instance_type.txt']}
+    changed_tables = create_schema.load_ddl_scripts(['table_ec2.txt'], changed_ddl_scripts_dir, migration_files)
+    deploy(data_api, changed_tables)
+    assert [] == data_api.created_tables
+    assert 'ALTER TABLE ec2\n  ADD COLUMN instance_type VARCHAR(30)' in data_api.statements
+
+def test_deploy_records_migrations_of_new_tables(changed_ddl_scripts_dir):
+    data_api = LocalDataApi()
+    migration_files = {'ec2': ['migration_ec2_instance_type.txt']}
+    changed_tables = create_schema.load_ddl_scripts(['table_ec2.txt'], changed_ddl_scripts_dir, migration_files)
+    deploy(data_api, changed_tables)
+    assert ['ec2'] == data_api.created_tables
+    assert 'migration/migration_ec2_instance_type.txt' in data_api.checksums
+    assert not any(statement.startswith('ALTER') for statement in data_api.statements)
+
+def test_deploy_resumes_failed_migrations(tables, changed_ddl_scripts_dir):
+    data_api = LocalDataApi()
+    deploy(data_api, tables)
+    migration_files = {'ec2': ['migration_ec2_instance_type.txt']}
+    changed_tables = create_schema.load_ddl_scripts(['table_ec2.txt'], changed_ddl_scripts_dir, migration_files)
+    data_api.fail_on = 'UPDATE'
+    with pytest.raises(ClientError):
+        deploy(data_api, changed_tables)
+    assert 'migration/migration_ec2_instance_type.txt#1' in data_api.checksums
+    assert 'migration/migration_ec2_instance_type.txt' not in data_api.checksums
+    data_api.fail_on = None
+    data_api.statements.clear()
+    assert ['ec2'] == deploy(data_api, changed_tables)
+    # the column is not added twice
+    assert not any(statement.startswith('ALTER') for statement in data_api.statements)
+    assert "UPDATE ec2 SET instance_type='unknown'" in data_api.continued_after_timeout
+    assert 'migration/migration_ec2_instance_type.txt' in data_api.checksums
+
+def test_internal_errors_are_not_resume_errors():
+    error = ClientError({'Error': {'Code': 'InternalServerErrorException', 'Message': 'Internal error'}}, 'ExecuteStatement')
+    assert not create_schema.is_resume_error(error)
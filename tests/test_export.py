@@ -0,0 +1,142 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import json
+import os
+import time
+import pytest
+from helper.dal import DataAccessLayer
+from helper.export import InventoryExporter, build_partitions, export_table_specs
+from conftest import cluster_arn, secret_arn, RecordingDataApi
+
+ddl_scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deploy_scripts', 'ddl_scripts')
+
+class LocalTables:
+    # In-memory stand-in for DataAccessLayer.scan_table over sorted primary keys
+    def __init__(self, tables):
+        # rows with the same key are written once, as insert ignore does with the primary key
+        self._tables = { table_name: sorted(set(map(tuple, rows))) for table_name, rows in tables.items() }
+
+    def scan_table(self, table_name, columns, key_columns, after_key=None, lower_bound=None, upper_bound=None, limit=1000):
+        num_keys = len(key_columns)
+        rows = [ row for row in self._tables[table_name]
+            if (after_key is None or row[:num_keys] > tuple(after_key))
+            and (lower_bound is None or row[0] >= lower_bound)
+            and (upper_bound is None or row[0] < upper_bound) ]
+        return [ list(row) for row in rows[:limit] ]
+
+class LocalWriter:
+    def __init__(self):
+        self.chunks = dict()
+
+    def write(self, key, body):
+        self.chunks[key] = body
+
+@pytest.fixture()
+def dal():
+    return LocalTables({
+        'ec2': [ [f'i-{i:03d}', 'us-east-1', '123456789012', '2019-03-06 02:45:32'] for i in range(25) ],
+        'package': [ [f'package-{i}', 'v1'] for i in range(7) ],
+        'ec2_package': [ [f'i-{i:03d}', 'package-1', 'v1'] for i in range(25) ]
+    })
+
+def exported_rows(writer, table_name):
+    return [ json.loads(line) for key in sorted(writer.chunks) if f'/{table_name}/' in key for line in writer.chunks[key].splitlines() ]
+
+def test_export_all_partitions_in_pages(dal):
+    writer = LocalWriter()
+    partitions = build_partitions(dal, ['ec2', 'package', 'ec2_package'], key_splits={'ec2': ['i-010']})
+    InventoryExporter(dal, writer, page_size=10).run('export-1', partitions, time.monotonic() + 60)
+    assert all(partition['complete'] for partition in partitions)
+    assert [ f'i-{i:03d}' for i in range(25) ] == [ row['aws_instance_id'] for row in exported_rows(writer, 'ec2') ]
+    assert 7 == len(exported_rows(writer, 'package'))
+    assert 25 == len(exported_rows(writer, 'ec2_package'))
+
+def test_export_resumes_from_cursor_after_deadline(dal):
+    writer = LocalWriter()
+    partitions = build_partitions(dal, ['ec2'])
+    exporter = InventoryExporter(dal, writer, page_size=10)
+    exporter.run('export-1', partitions, time.monotonic() - 1)
+    assert not partitions[0]['complete']
+    # the partition state round-trips through JSON between invocations
+    partitions = json.loads(json.dumps(partitions))
+    exporter.run('export-1', partitions, time.monotonic() + 60)
+    assert partitions[0]['complete']
+    assert 25 == partitions[0]['num_rows']
+    assert 25 == len(exported_rows(writer, 'ec2'))
+
+def test_export_columnar_chunks(dal):
+    writer = LocalWriter()
+    partitions = build_partitions(dal, ['package'])
+    InventoryExporter(dal, writer, export_format='columnar', page_size=5).run('export-1', partitions, time.monotonic() + 60)
+    chunks = [ json.loads(writer.chunks[key]) for key in sorted(writer.chunks) ]
+    assert [5, 2] == [ chunk['num_rows'] for chunk in chunks ]
+    assert ['v1'] * 5 == chunks[0]['data']['package_version']
+
+def test_export_key_columns_are_primary_keys():
+    # keyset pagination is only an index range scan, and only returns every row, over a unique key
+    for table_name, spec in export_table_specs.items():
+        with open(os.path.join(ddl_scripts_dir, f'table_{table_name}.txt'), 'r') as ddl_script:
+            ddl = ' '.join(ddl_script.read().split())
+        key_columns = ', '.join(spec['key_columns'])
+        assert f'PRIMARY KEY ({key_columns})' in ddl
+
+def test_export_pages_within_an_instance_with_repeated_packages():
+    # 3 EC2s with 12 packages each, every relation saved twice (eg, repeated in the POST body)
+    relations = [ [f'i-{i:03d}', f'package-{j:02d}', 'v1'] for i in range(3) for j in range(12) ]
+    dal = LocalTables({'ec2_package': relations + relations})
+    writer = LocalWriter()
+    partitions = build_partitions(dal, ['ec2_package'])
+    InventoryExporter(dal, writer, page_size=5).run('export-1', partitions, time.monotonic() + 60)
+    assert relations == [ [row['aws_instance_id'], row['package_name'], row['package_version']] for row in exported_rows(writer, 'ec2_package') ]
+
+def test_scan_table_expands_the_keyset_predicate():
+    data_api = RecordingDataApi([[{'stringValue': 'i-001'}, {'stringValue': 'package-1'}, {'stringValue': 'v1'}]])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    key_columns = ['aws_instance_id', 'package_name', 'package_version']
+    rows = dal.scan_table('ec2_package', key_columns, key_columns, after_key=['i-001', 'package-0', 'v2'], upper_bound='i-010', limit=10)
+    assert [['i-001', 'package-1', 'v1']] == rows
+    sql, parameters = data_api.statements[0]
+    assert 'select aws_instance_id, package_name, package_version from ec2_package' \
+        ' where aws_instance_id < :upper_bound and aws_instance_id>=:after_key_0' \
+        ' and ((aws_instance_id>:after_key_0)' \
+        ' or (aws_instance_id=:after_key_0 and package_name>:after_key_1)' \
+        ' or (aws_instance_id=:after_key_0 and package_name=:after_key_1 and package_version>:after_key_2))' \
+        ' order by aws_instance_id, package_name, package_version limit 10' == sql
+    assert {'upper_bound': 'i-010', 'after_key_0': 'i-001', 'after_key_1': 'package-0', 'after_key_2': 'v2'} == parameters
+
+def test_find_key_splits_samples_keys_without_offset():
+    keys = [ [{'stringValue': f'i-{i:03d}'}] for i in range(25) ]
+    data_api = RecordingDataApi(responses=[[[{'longValue': 25}]], keys])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    assert ['i-008', 'i-016'] == dal.find_key_splits('ec2', 'aws_instance_id', 3)
+    sql, parameters = data_api.statements[1]
+    assert 'select aws_instance_id from ec2 where rand() < :sample_fraction order by aws_instance_id' == sql
+    # small tables are read whole
+    assert 1.0 == parameters['sample_fraction']
+
+def test_find_key_splits_samples_large_tables():
+    keys = [ [{'stringValue': f'i-{i:03d}'}] for i in range(400) ]
+    data_api = RecordingDataApi(responses=[[[{'longValue': 10 ** 6}]], keys])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    assert ['i-100', 'i-200', 'i-300'] == dal.find_key_splits('ec2', 'aws_instance_id', 4)
+    assert 4 * 100 / 10 ** 6 == pytest.approx(data_api.statements[1][1]['sample_fraction'])
+    # too few rows to split
+    data_api = RecordingDataApi(responses=[[[{'longValue': 3}]]])
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    assert [] == dal.find_key_splits('ec2', 'aws_instance_id', 4)
+    assert ['select'] == data_api.calls
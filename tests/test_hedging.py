@@ -0,0 +1,76 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import threading
+import time
+from helper.dal import DataAccessLayer
+from helper.hedging import HedgePolicy
+from conftest import cluster_arn, secret_arn
+
+class SlowDataApi:
+    # Stand-in rds-data client: the n-th call sleeps latencies_secs[n] and returns {'records': [], 'call': n}
+    def __init__(self, latencies_secs):
+        self._latencies_secs = latencies_secs
+        self._lock = threading.Lock()
+        self.num_calls = 0
+
+    def execute_statement(self, **kwargs):
+        with self._lock:
+            call = self.num_calls
+            self.num_calls += 1
+        time.sleep(self._latencies_secs[call])
+        return {'records': [], 'call': call}
+
+def hedged_dal(data_api, hedge_policy):
+    return DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, hedge_policy, rdsdata_client=data_api)
+
+def test_hedge_wins_when_primary_is_slow():
+    hedge_policy = HedgePolicy(default_delay_ms=10, budget_ratio=1.0)
+    hedge_policy.record_request(1)
+    dal = hedged_dal(SlowDataApi([1.0, 0.0]), hedge_policy)
+    assert 1 == dal.execute_statement('select 1', idempotent=True)['call']
+    stats = hedge_policy.stats()
+    assert 1 == stats['hedges']
+    assert 1 == stats['hedge_wins']
+
+def test_hedge_delay_tracks_primary_latency():
+    hedge_policy = HedgePolicy(min_samples=2, default_delay_ms=10, budget_ratio=1.0)
+    hedge_policy.record_request(1)
+    dal = hedged_dal(SlowDataApi([0.3, 0.0]), hedge_policy)
+    assert 1 == dal.execute_statement('select 1', idempotent=True)['call']
+    time.sleep(0.5)
+    # the primary's latency, not the latency after hedging
+    assert 300 <= hedge_policy.delay_ms()
+
+def test_no_hedge_without_budget():
+    hedge_policy = HedgePolicy(default_delay_ms=10, budget_ratio=0.0)
+    dal = hedged_dal(SlowDataApi([0.1, 0.0]), hedge_policy)
+    assert 0 == dal.execute_statement('select 1', idempotent=True)['call']
+    assert 0 == hedge_policy.stats()['hedges']
+
+def test_no_hedge_for_non_idempotent_statements():
+    hedge_policy = HedgePolicy(default_delay_ms=10, budget_ratio=1.0)
+    hedge_policy.record_request(1)
+    data_api = SlowDataApi([0.1, 0.0])
+    hedged_dal(data_api, hedge_policy).execute_statement('insert into package values (1, 1)', idempotent=True)
+    assert 1 == data_api.num_calls
+
+def test_hedge_delay_tracks_recent_p95_latency():
+    hedge_policy = HedgePolicy(min_samples=10)
+    for latency_ms in range(1, 101):
+        hedge_policy.record_request(latency_ms)
+    assert 96 == hedge_policy.delay_ms()
@@ -0,0 +1,127 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import json
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from helper.dal import DataAccessLayerException
+from helper.loader import BulkLoader, Checkpoint
+
+primary_keys = {
+    'package': ['package_name', 'package_version'],
+    'ec2': ['aws_instance_id'],
+    'ec2_package': ['aws_instance_id', 'package_name', 'package_version'],
+    # EC2s marked complete
+    'ec2_complete': ['aws_instance_id']
+}
+
+class LocalDal:
+    # Records the rows written per table by primary key, as 'insert ignore' does, and the number of
+    # rows written including ignored ones; optionally fails with error after a number of batches
+    def __init__(self, fail_after_batches=None, error=None):
+        self.rows = { table_name: dict() for table_name in primary_keys }
+        self.num_writes = { table_name: 0 for table_name in primary_keys }
+        self._fail_after_batches = fail_after_batches
+        self._error = error if error is not None else ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Communications link failure'}}, 'BatchExecuteStatement')
+        self.num_failures = 0
+        self._num_batches = 0
+        self._lock = threading.Lock()
+
+    def _save(self, table_name, rows):
+        with self._lock:
+            if self._fail_after_batches is not None and self._num_batches >= self._fail_after_batches:
+                self.num_failures += 1
+                raise DataAccessLayerException(self._error)
+            self._num_batches += 1
+            for row in rows:
+                self.rows[table_name].setdefault(tuple(row[column] for column in primary_keys[table_name]), row)
+            self.num_writes[table_name] += len(rows)
+
+    def save_packages_batch(self, package_list, batch_size):
+        self._save('package', package_list)
+
+    def save_ec2_batch(self, ec2_list, batch_size):
+        self._save('ec2', ec2_list)
+
+    def save_relations_batch(self, relation_list, batch_size, ignore_key_conflict=True):
+        self._save('ec2_package', relation_list)
+
+    def complete_ec2_batch(self, aws_instance_id_list, batch_size):
+        self._save('ec2_complete', [ {'aws_instance_id': aws_instance_id} for aws_instance_id in aws_instance_id_list ])
+
+@pytest.fixture()
+def inventory_file(tmp_path):
+    file_path = tmp_path / 'inventory.ndjson'
+    with open(file_path, 'w') as f:
+        for i in range(20):
+            packages = [ {'package_name': f'package-{j}', 'package_version': 'v1'} for j in range(i % 5) ]
+            f.write(json.dumps({'aws_instance_id': f'i-{i:03d}', 'aws_region': 'us-east-1', 'aws_account': '123456789012', 'packages': packages}) + '\n')
+    return str(file_path)
+
+def test_load_deduplicates_packages_globally(inventory_file):
+    dal = LocalDal()
+    rows_written = BulkLoader(dal, batch_size=3, max_workers=2, max_in_flight=2).load(inventory_file)
+    assert {'package': 4, 'ec2': 20, 'ec2_package': 40, 'ec2_complete': 20} == rows_written
+    assert sorted(f'package-{j}' for j in range(4)) == sorted(package['package_name'] for package in dal.rows['package'].values())
+    assert 40 == len(dal.rows['ec2_package'])
+
+def test_load_resumes_from_checkpoint(inventory_file, tmp_path, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda secs: None)
+    checkpoint_file = str(tmp_path / 'inventory.checkpoint')
+    failing_dal = LocalDal(fail_after_batches=5)
+    with pytest.raises(DataAccessLayerException):
+        BulkLoader(failing_dal, batch_size=3, max_workers=1, max_in_flight=1, checkpoint=Checkpoint(checkpoint_file)).load(inventory_file)
+    checkpoint = Checkpoint(checkpoint_file)
+    assert 1 == checkpoint.phase_index
+    dal = LocalDal()
+    BulkLoader(dal, batch_size=3, max_workers=1, max_in_flight=1, checkpoint=checkpoint).load(inventory_file)
+    # packages are not loaded again; EC2s resume right after the last acknowledged batch
+    assert {} == dal.rows['package']
+    loaded_ec2s = set(failing_dal.rows['ec2']) | set(dal.rows['ec2'])
+    assert 20 == len(loaded_ec2s)
+    assert len(dal.rows['ec2']) < 20
+
+def test_load_resumes_relations_without_duplicates(inventory_file, tmp_path, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda secs: None)
+    checkpoint_file = str(tmp_path / 'inventory.checkpoint')
+    # 2 package and 7 EC2 batches, then fails after 3 of the 14 relation batches
+    dal = LocalDal(fail_after_batches=12)
+    with pytest.raises(DataAccessLayerException):
+        BulkLoader(dal, batch_size=3, max_workers=1, max_in_flight=1, checkpoint=Checkpoint(checkpoint_file)).load(inventory_file)
+    checkpoint = Checkpoint(checkpoint_file)
+    assert 2 == checkpoint.phase_index
+    # no EC2 is listed by the change feed before all the relations are loaded
+    assert {} == dal.rows['ec2_complete']
+    dal._fail_after_batches = None
+    BulkLoader(dal, batch_size=3, max_workers=1, max_in_flight=1, checkpoint=checkpoint).load(inventory_file)
+    # relations of the record split across the last acknowledged batch are written again, and ignored
+    assert dal.num_writes['ec2_package'] > 40
+    assert 40 == len(dal.rows['ec2_package'])
+    assert 20 == len(dal.rows['ec2_complete'])
+
+def test_load_retries_only_unavailability_errors(inventory_file, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda secs: None)
+    dal = LocalDal(fail_after_batches=0)
+    with pytest.raises(DataAccessLayerException):
+        BulkLoader(dal, batch_size=3, max_workers=1, max_in_flight=1).load(inventory_file)
+    assert 3 == dal.num_failures
+    error = ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Data too long for column'}}, 'BatchExecuteStatement')
+    dal = LocalDal(fail_after_batches=0, error=error)
+    with pytest.raises(DataAccessLayerException):
+        BulkLoader(dal, batch_size=3, max_workers=1, max_in_flight=1).load(inventory_file)
+    assert 1 == dal.num_failures
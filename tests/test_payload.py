@@ -0,0 +1,100 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import hashlib
+import json
+import pytest
+from botocore.exceptions import ClientError
+import helper.dal
+from helper.dal import DataAccessLayer, DataAccessLayerException
+from helper.payload import Ec2Payload
+from conftest import cluster_arn, secret_arn, RecordingDataApi
+
+def packages(num_packages):
+    return [ {'package_name': f'package-{i % 7}', 'package_version': f'v{i}'} for i in range(num_packages) ]
+
+def test_payload_matches_json_loads():
+    input_fields = {'aws_region': 'us-east-1', 'aws_account': '123456789012', 'packages': packages(5)}
+    payload = Ec2Payload(json.dumps(input_fields, indent=2))
+    assert {'aws_region': 'us-east-1', 'aws_account': '123456789012'} == payload.fields
+    assert ['aws_region', 'aws_account', 'packages'] == payload.field_names
+    assert 5 == payload.num_packages
+    assert input_fields['packages'] == list(payload.iter_packages())
+    canonical_packages = json.dumps(input_fields['packages'], sort_keys=True, separators=(',', ':'))
+    assert hashlib.sha256(canonical_packages.encode('utf-8')).hexdigest() == payload.packages_sha256
+
+def test_payload_without_packages():
+    payload = Ec2Payload('{"aws_region": "us-east-1", "packages": []}')
+    assert 0 == payload.num_packages
+    assert [] == list(payload.iter_packages())
+    assert hashlib.sha256(b'[]').hexdigest() == payload.packages_sha256 == Ec2Payload('{}').packages_sha256
+
+@pytest.mark.parametrize('body', [
+    '', '[]', '{"aws_region": "us-east-1"', '{"aws_region": "us-east-1",}', '{"aws_region": "us-east-1"} {}',
+    '{"packages": [{"package_name": "package-1"}]}', '{"packages": [{"package_name": "package-1", "package_version": "v1"},]}'
+])
+def test_payload_rejects_invalid_bodies(body):
+    with pytest.raises(ValueError):
+        Ec2Payload(body)
+
+def test_save_ec2_writes_packages_in_chunks(monkeypatch):
+    monkeypatch.setattr(helper.dal, 'package_version_summary_enabled', True)
+    data_api = RecordingDataApi()
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    payload = Ec2Payload(json.dumps({'aws_region': 'us-east-1', 'aws_account': '123456789012', 'packages': packages(25) + packages(5)}))
+    dal.save_ec2('i-01aaae43feb712345', dict(payload.fields, packages=payload.iter_packages()), batch_size=10)
+    # the last chunk holds 5 new packages and 5 duplicates, which the summary counts once
+    assert [('package', 10), ('ec2_package', 10), ('package_version_summary', 10)] * 2 \
+        + [('package', 10), ('ec2_package', 10), ('package_version_summary', 5)] == data_api.batches
+    # each chunk's relations and summary increments commit together, and the EC2 enters the change
+    # feed once all its chunks are saved
+    assert ['insert'] \
+        + ['batch package', 'begin', 'batch ec2_package (tx-1)', 'batch package_version_summary (tx-1)', 'commit'] * 3 \
+        + ['update'] == data_api.calls
+
+def test_save_ec2_rolls_back_relations_when_summary_fails(monkeypatch):
+    monkeypatch.setattr(helper.dal, 'package_version_summary_enabled', True)
+    data_api = RecordingDataApi(fail_on='insert into package_version_summary')
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    with pytest.raises(DataAccessLayerException):
+        dal.save_ec2('i-01aaae43feb712345', {'aws_region': 'us-east-1', 'aws_account': '123456789012', 'packages': packages(5)})
+    assert ['insert', 'batch package', 'begin', 'batch ec2_package (tx-1)', 'batch package_version_summary (tx-1)', 'rollback'] == data_api.calls
+
+def duplicate_ec2_error():
+    return ClientError({'Error': {'Code': 'BadRequestException', 'Message': "Duplicate entry 'i-01aaae43feb712345' for key 'PRIMARY'"}}, 'ExecuteStatement')
+
+def test_save_ec2_resumes_incomplete_save(monkeypatch):
+    monkeypatch.setattr(helper.dal, 'package_version_summary_enabled', True)
+    # an earlier save in us-west-2 committed the relation to package-0 v0 before failing
+    data_api = RecordingDataApi(responses=[
+        [], [[{'stringValue': 'us-west-2'}, {'stringValue': '123456789012'}]], [[{'stringValue': 'package-0'}, {'stringValue': 'v0'}]], []
+    ], fail_on='insert into ec2 ', error=duplicate_ec2_error())
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    dal.save_ec2('i-01aaae43feb712345', {'aws_region': 'us-east-1', 'aws_account': '123456789012', 'packages': packages(3)})
+    assert ['insert', 'select', 'batch package', 'begin', 'select (tx-1)', 'batch ec2_package (tx-1)',
+            'batch package_version_summary (tx-1)', 'commit', 'update'] == data_api.calls
+    assert 'completion_date_utc is null' in data_api.statements[1][0]
+    # package-0 v0 is not counted again
+    assert [('package', 3), ('ec2_package', 3), ('package_version_summary', 2)] == data_api.batches
+
+def test_save_ec2_rejects_complete_ec2():
+    data_api = RecordingDataApi(fail_on='insert into ec2 ', error=duplicate_ec2_error())
+    dal = DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api)
+    with pytest.raises(DataAccessLayerException) as e:
+        dal.save_ec2('i-01aaae43feb712345', {'aws_region': 'us-east-1', 'aws_account': '123456789012', 'packages': packages(3)})
+    assert 'Duplicate entry' in str(e.value.original_exception)
+    assert ['insert', 'select'] == data_api.calls
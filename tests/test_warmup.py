@@ -0,0 +1,68 @@
+'''
+ * Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ * software and associated documentation files (the "Software"), to deal in the Software
+ * without restriction, including without limitation the rights to use, copy, modify,
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ * permit persons to whom the Software is furnished to do so.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+import importlib
+import json
+import pytest
+from helper.dal import DataAccessLayer
+from helper.lambdautils import is_warmup_event
+from conftest import cluster_arn, secret_arn, RecordingDataApi
+
+handler_module_names = ['add_ec2_info', 'get_ec2_info', 'get_ec2_changes', 'get_package_stats']
+
+eventbridge_event = {
+    'version': '0',
+    'detail-type': 'Scheduled Event',
+    'source': 'aws.events',
+    'resources': ['arn:aws:events:us-east-1:123456789012:rule/keep-warm'],
+    'detail': {}
+}
+
+get_event = {
+    'httpMethod': 'GET',
+    'pathParameters': {'aws_instance_id': 'i-0000000001'}
+}
+
+def test_is_warmup_event():
+    assert is_warmup_event({'warmup': True})
+    assert is_warmup_event(eventbridge_event)
+    assert not is_warmup_event(get_event)
+    assert not is_warmup_event({'warmup': 'true'})
+    assert not is_warmup_event(None)
+
+@pytest.fixture()
+def data_api():
+    return RecordingDataApi()
+
+def load_handler_module(name, data_api, monkeypatch):
+    module = importlib.import_module(name)
+    monkeypatch.setattr(module, 'dal', DataAccessLayer('ec2_inventory_db', cluster_arn, secret_arn, rdsdata_client=data_api))
+    return module
+
+@pytest.mark.parametrize('name', handler_module_names)
+@pytest.mark.parametrize('event', [{'warmup': True}, eventbridge_event])
+def test_warmup_event_only_pings_the_database(name, event, data_api, monkeypatch):
+    response = load_handler_module(name, data_api, monkeypatch).handler(event, None)
+    assert 200 == response['statusCode']
+    assert {'warm': True} == json.loads(response['body'])
+    assert [('select 1', {})] == data_api.statements
+
+def test_api_events_are_not_warmup_events(data_api, monkeypatch):
+    response = load_handler_module('get_ec2_info', data_api, monkeypatch).handler(get_event, None)
+    assert 200 == response['statusCode']
+    assert {'record': {}, 'record_found': False} == json.loads(response['body'])
+    assert 'select 1' not in [ sql for sql, _ in data_api.statements ]